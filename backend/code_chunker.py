@@ -0,0 +1,550 @@
+# backend/code_chunker.py
+"""
+Tree-sitter chunk extraction for C/C++ sources. Kept apart from rag_module so extraction worker
+processes can import it without loading the embedding model or opening ChromaDB.
+"""
+import os
+import re
+import mmap
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+import tree_sitter
+from tree_sitter_languages import get_language
+
+# --- Tree-sitter Language and Parser Setup ---
+C_LANGUAGE = None
+CPP_LANGUAGE = None
+
+# tree-sitter parsers must not be shared between threads, so each thread gets its own per language
+_parser_tls = threading.local()
+
+def get_parser(lang: str):
+    """
+    Returns this thread's parser for 'c' or 'cpp', creating it on first use.
+    """
+    parser = getattr(_parser_tls, lang, None)
+    if parser is None:
+        parser = tree_sitter.Parser()
+        parser.set_language(C_LANGUAGE if lang == 'c' else CPP_LANGUAGE)
+        setattr(_parser_tls, lang, parser)
+    return parser
+
+def init_parsers():
+    """
+    Builds the calling thread's parsers. Also the initializer of rag_module's extraction worker
+    processes, so each worker has its parsers ready before the first file arrives.
+    """
+    get_parser('c')
+    get_parser('cpp')
+
+try:
+    C_LANGUAGE = get_language('c')
+    CPP_LANGUAGE = get_language('cpp')
+    # Create the importing thread's parsers now so grammar problems surface at startup
+    init_parsers()
+
+except Exception as e:
+    print(f"Error loading tree-sitter C/C++ parsers: {e}")
+    print("Please ensure 'tree_sitter_languages' can find and load the 'c' and 'cpp' grammars.")
+    print("You might need to install 'tree_sitter' and 'tree_sitter_languages' using pip.")
+    exit("Cannot proceed without tree-sitter parsers.")
+
+
+# --- Tree-sitter Query Patterns for C++ ---
+CPP_FUNCTION_QUERY_PATTERN = r"""
+    (function_definition
+        declarator: (function_declarator) @function.declarator_node
+        body: (compound_statement) @function.body
+    ) @function.definition
+"""
+
+CPP_CLASS_QUERY_PATTERN = r"""
+    (class_specifier
+        name: (type_identifier) @class.name
+        body: (field_declaration_list) @class.body
+    ) @class.definition
+"""
+
+CPP_STRUCT_QUERY_PATTERN = r"""
+    (struct_specifier
+        name: (type_identifier) @struct.name
+        body: (field_declaration_list) @struct.body
+    ) @struct.definition
+"""
+
+CPP_GLOBAL_ARRAY_INIT_QUERY_PATTERN = r"""
+    (init_declarator
+        declarator: (array_declarator
+            (identifier) @array.name
+            "[" "]"
+        )
+        value: (initializer_list) @array.body
+    ) @array.definition
+    (declaration
+        (array_declarator
+            (identifier) @array.name
+            "[" "]"
+        )
+        (initializer_list) @array.body
+    ) @array.definition
+"""
+
+# --- Tree-sitter Query Patterns for C (ADJUSTED for 'Invalid node type type_declarator') ---
+C_FUNCTION_QUERY_PATTERN = r"""
+    (function_definition
+        declarator: (function_declarator) @function.declarator_node
+        body: (compound_statement) @function.body
+    ) @function.definition
+"""
+
+C_CLASS_QUERY_PATTERN = r""
+
+# REVISED C_STRUCT_QUERY_PATTERN to avoid 'type_declarator' in query
+# Instead, capture the 'type_identifier' directly as the alias.
+C_STRUCT_QUERY_PATTERN = r"""
+    (struct_specifier
+        name: (type_identifier) @struct.name
+        body: (field_declaration_list) @struct.body
+    ) @struct.definition
+
+    (type_definition ; for typedef struct { ... } alias; in C
+        type: (struct_specifier
+            name: (type_identifier) @typedef_struct_name ; for optional explicit struct name
+            body: (field_declaration_list) @typedef_struct_body
+        )
+        ; Capture the type_identifier directly at the end of typedef_definition
+        (type_identifier) @typedef_alias_name ; Capture the alias name directly
+    ) @typedef_struct.definition
+"""
+
+C_GLOBAL_ARRAY_INIT_QUERY_PATTERN = r"""
+    (declaration
+        declarator: (init_declarator
+            declarator: (pointer_declarator
+                (array_declarator
+                    declarator: (identifier) @array.name
+                )
+            )
+            value: (initializer_list)
+        )
+    ) @array.definition
+    (declaration
+        declarator: (init_declarator
+            declarator: (array_declarator
+                declarator: (identifier) @array.name
+                size: (number_literal)
+            )
+            value: (initializer_list)
+        )
+    ) @array.definition
+"""
+
+
+# Universal Comment Query
+COMMENT_QUERY_PATTERN = r"""
+    (comment) @comment.block
+"""
+
+# Comment runs shorter than this (after merging adjacent comments) are not worth a chunk
+MIN_COMMENT_CHUNK_CHARS = 40
+COMMENT_HAS_TEXT_PATTERN = re.compile(r'[A-Za-z0-9]')
+
+# Case-sensitive on purpose: the upper-case alternatives only mean something without IGNORECASE,
+# which also made names like "latestValue" look like tests
+TEST_FUNCTION_NAME_PATTERN = re.compile(
+    r'(?:^|_)test_\w*$|'
+    r'^[A-Z_]+_TEST_\w*$|'
+    r'^[A-Z_]+_CASE_\w*$|'
+    r'(?:^|_)Test[A-Z]\w*$'
+)
+
+def is_test_function_name(func_name: str) -> bool:
+    # Cheap substring checks rule out almost every function before the regex runs
+    if 'test' not in func_name and 'Test' not in func_name and 'TEST' not in func_name and 'CASE' not in func_name:
+        return False
+    # Member functions arrive scope-qualified ("MathTest::TestAdd"); the anchors apply to the name itself
+    return TEST_FUNCTION_NAME_PATTERN.search(func_name.rpartition('::')[2]) is not None
+
+
+# --- Compiled Tree-sitter Queries (compiled once at import, reused for every file) ---
+def definition_nodes_pattern(node_types):
+    # One capture per node type that extract_code_chunks turns into a chunk
+    return "\n".join(f"({node_type}) @definition" for node_type in node_types)
+
+def compile_queries(language, function_pattern, class_pattern, struct_pattern, array_pattern):
+    node_types = ['struct_specifier', 'type_definition', 'function_definition', 'declaration', 'comment']
+    if class_pattern:
+        node_types.insert(0, 'class_specifier')
+    return {
+        "definitions": language.query(definition_nodes_pattern(node_types)),
+        "function": language.query(function_pattern),
+        "class": language.query(class_pattern) if class_pattern else None,
+        "struct": language.query(struct_pattern),
+        "array": language.query(array_pattern),
+        "comment": language.query(COMMENT_QUERY_PATTERN),
+    }
+
+try:
+    CPP_QUERIES = compile_queries(CPP_LANGUAGE, CPP_FUNCTION_QUERY_PATTERN, CPP_CLASS_QUERY_PATTERN,
+                                  CPP_STRUCT_QUERY_PATTERN, CPP_GLOBAL_ARRAY_INIT_QUERY_PATTERN)
+    C_QUERIES = compile_queries(C_LANGUAGE, C_FUNCTION_QUERY_PATTERN, C_CLASS_QUERY_PATTERN,
+                                C_STRUCT_QUERY_PATTERN, C_GLOBAL_ARRAY_INIT_QUERY_PATTERN)
+except Exception as e:
+    print(f"Error compiling tree-sitter queries: {e}")
+    print("This often means the query syntax does not match the specific grammar version or language.")
+    exit("Cannot proceed without tree-sitter queries.")
+
+
+# --- Incremental Re-parsing ---
+# Last parsed source and tree per uploaded file name. When a file is uploaded again with a small
+# change, the old tree is edited and handed to the parser so unchanged subtrees are reused. Only
+# sources parsed from bytes are cached; large files are mapped from disk and parsed in full.
+PARSE_TREE_CACHE_SIZE = 32
+PARSE_TREE_CACHE_MAX_BYTES = 8 * 1024 * 1024 # Total source kept across entries
+MAX_INCREMENTAL_EDIT_FRACTION = 0.5 # Larger edits are parsed from scratch
+_parse_tree_cache = OrderedDict()
+_parse_tree_cache_lock = threading.Lock()
+
+def _common_prefix_len(a: bytes, b: bytes) -> int:
+    # Compare whole blocks first so the byte-by-byte loop only runs inside the first differing block
+    limit = min(len(a), len(b))
+    block = 4096
+    i = 0
+    while i + block <= limit and a[i:i + block] == b[i:i + block]:
+        i += block
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+def _common_suffix_len(a: bytes, b: bytes, limit: int) -> int:
+    block = 4096
+    n = 0
+    while n + block <= limit and a[len(a) - n - block:len(a) - n] == b[len(b) - n - block:len(b) - n]:
+        n += block
+    while n < limit and a[len(a) - n - 1] == b[len(b) - n - 1]:
+        n += 1
+    return n
+
+def _byte_point(data: bytes, offset: int):
+    # tree-sitter points are (row, column) with the column counted in bytes
+    row = data.count(b"\n", 0, offset)
+    return (row, offset - (data.rfind(b"\n", 0, offset) + 1))
+
+def parse_source(lang: str, code_bytes: bytes, cache_key: Optional[str] = None):
+    """
+    Parses code_bytes as 'c' or 'cpp', incrementally against the previous tree stored under cache_key when the
+    change since then is a small enough edit. Without a cache_key, or for a buffer that is not
+    bytes (an mmap), this is a plain full parse.
+    """
+    parser = get_parser(lang)
+    if cache_key is None or not isinstance(code_bytes, bytes) or len(code_bytes) > PARSE_TREE_CACHE_MAX_BYTES:
+        # Caching an mmap would mean copying the whole file onto the heap to keep it past close
+        return parser.parse(code_bytes)
+
+    cache_key = (lang, cache_key)
+    with _parse_tree_cache_lock:
+        # Take the entry out while using it: Tree.edit mutates the tree in place
+        previous = _parse_tree_cache.pop(cache_key, None)
+
+    tree = None
+    if previous is not None:
+        old_bytes, old_tree = previous
+        prefix = _common_prefix_len(old_bytes, code_bytes)
+        suffix = _common_suffix_len(old_bytes, code_bytes, min(len(old_bytes), len(code_bytes)) - prefix)
+        old_end = len(old_bytes) - suffix
+        new_end = len(code_bytes) - suffix
+        changed = max(old_end, new_end) - prefix
+        if changed <= MAX_INCREMENTAL_EDIT_FRACTION * max(len(code_bytes), 1):
+            old_tree.edit(
+                start_byte=prefix,
+                old_end_byte=old_end,
+                new_end_byte=new_end,
+                start_point=_byte_point(old_bytes, prefix),
+                old_end_point=_byte_point(old_bytes, old_end),
+                new_end_point=_byte_point(code_bytes, new_end),
+            )
+            tree = parser.parse(code_bytes, old_tree)
+    if tree is None:
+        tree = parser.parse(code_bytes)
+
+    with _parse_tree_cache_lock:
+        _parse_tree_cache[cache_key] = (code_bytes, tree)
+        _parse_tree_cache.move_to_end(cache_key)
+        cached_bytes = sum(len(source) for source, _ in _parse_tree_cache.values())
+        while len(_parse_tree_cache) > PARSE_TREE_CACHE_SIZE or cached_bytes > PARSE_TREE_CACHE_MAX_BYTES:
+            source, _ = _parse_tree_cache.popitem(last=False)[1]
+            cached_bytes -= len(source)
+    return tree
+
+
+# === Code Chunk Extraction (using Tree-sitter) ===
+def extract_code_chunks(file_path: str, cache_key: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Extracts function, class, struct, array and comment chunks from a C/C++ file.
+    With a cache_key (the upload's original file name), files small enough for the parse tree
+    cache are read into memory so a later upload of the same name can be re-parsed incrementally.
+    """
+    # Otherwise map the file instead of reading it, so the parser works straight from the page
+    # cache rather than a second copy on the heap. Empty files cannot be mapped.
+    try:
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if cache_key is not None and file_size <= PARSE_TREE_CACHE_MAX_BYTES:
+                code_bytes = f.read()
+            elif file_size:
+                code_bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                code_bytes = b""
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
+        return []
+
+    try:
+        return extract_code_chunks_from_source(code_bytes, file_path, cache_key)
+    finally:
+        if isinstance(code_bytes, mmap.mmap):
+            code_bytes.close()
+
+def extract_code_chunks_from_source(code_bytes, file_path: str, cache_key: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Extracts chunks from source held in memory (bytes or mmap). file_path picks the language by
+    its extension and names the chunks' source.
+    """
+    chunks = []
+    
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    lang = None
+    current_language = None
+    queries = None
+    
+    if file_extension in ['.cpp', '.hpp', '.cxx']:
+        lang = 'cpp'
+        current_language = CPP_LANGUAGE
+        queries = CPP_QUERIES
+    elif file_extension in ['.c', '.h']:
+        lang = 'c'
+        current_language = C_LANGUAGE
+        queries = C_QUERIES
+    else:
+        print(f"Warning: Unsupported file extension '{file_extension}'. Skipping {file_path}")
+        return []
+
+    if lang is None or current_language is None:
+        print(f"Error: No suitable parser found for file {file_path}")
+        return []
+
+    function_query = queries["function"]
+    class_query = queries["class"]
+    struct_query = queries["struct"]
+    global_array_init_query = queries["array"]
+    comment_query = queries["comment"]
+
+    tree = parse_source(lang, code_bytes, cache_key)
+    root_node = tree.root_node
+
+    # --- Helper Functions (defined within extract_code_chunks_from_source scope) ---
+    # Decoded text per byte range. Keyed on the range rather than id(node): tree-sitter hands out
+    # a new Python object on every access, so object ids are neither stable nor unique.
+    text_cache = {}
+
+    def get_range_content(start_byte, end_byte):
+        key = (start_byte, end_byte)
+        text = text_cache.get(key)
+        if text is None:
+            text = code_bytes[start_byte:end_byte].decode('utf-8', errors='ignore')
+            text_cache[key] = text
+        return text
+
+    def get_node_content(node):
+        return get_range_content(node.start_byte, node.end_byte)
+
+    def capture_map(captures):
+        # Capture names are unique per pattern, so look them up by exact name. A query on a node
+        # also matches nested definitions; setdefault keeps the first (outermost) capture per name.
+        cap_map = {}
+        for capture_node, capture_name in captures:
+            cap_map.setdefault(capture_name, capture_node)
+        return cap_map
+
+    def get_name_from_capture(cap_map, capture_name):
+        node = cap_map.get(capture_name)
+        return get_node_content(node) if node is not None else ""
+
+    def get_function_name_and_scope(func_declarator_node):
+        func_name = ""
+        scope_name = ""
+
+        name_node = None
+        for child in func_declarator_node.children:
+            if child.type == 'qualified_identifier':
+                name_node = child
+                break
+            elif child.type == 'identifier' or child.type == 'field_identifier':
+                name_node = child
+                
+        if name_node:
+            func_name_raw = get_node_content(name_node)
+            
+            if name_node.type == 'qualified_identifier':
+                parts = func_name_raw.split('::')
+                if len(parts) > 1:
+                    scope_name = "::".join(parts[:-1])
+                    func_name = parts[-1]
+                else:
+                    func_name = func_name_raw
+            else:
+                func_name = func_name_raw
+
+        func_name = func_name.split('(')[0].strip()
+
+        final_func_name = func_name
+        if scope_name and func_name and not func_name.startswith(f"{scope_name}::"):
+            final_func_name = f"{scope_name}::{func_name}"
+            
+        return final_func_name, scope_name
+
+
+    # Byte ranges of emitted chunks that may still enclose upcoming nodes. The traversal is
+    # pre-order, so nodes arrive sorted by start_byte with parents before children: a range that
+    # ends before the current node can be dropped, and only the innermost remaining range (the
+    # top) can contain it. This keeps the overlap check O(1) amortized instead of O(chunks).
+    processed_ranges = []
+    scope_stack = []
+
+    def add_chunk(node, chunk_type, func_name="", class_name="", struct_name="", array_name="", test_case_function_name="", end_byte=None):
+        # end_byte extends the chunk past the node, used for runs of adjacent comments
+        if end_byte is None:
+            end_byte = node.end_byte
+        while processed_ranges and processed_ranges[-1][1] < node.start_byte:
+            processed_ranges.pop()
+        if processed_ranges:
+            existing_start, existing_end = processed_ranges[-1]
+            if (existing_start <= node.start_byte and existing_end >= end_byte) or \
+               (node.start_byte <= existing_start and end_byte >= existing_end):
+                return
+
+        content = get_range_content(node.start_byte, end_byte)
+        
+        current_class_name_in_scope = ""
+        current_struct_name_in_scope = ""
+        for scope_type, scope_name, scope_end_byte in reversed(scope_stack):
+            if node.start_byte < scope_end_byte:
+                if scope_type == "class":
+                    current_class_name_in_scope = scope_name
+                    break
+                elif scope_type == "struct":
+                    current_struct_name_in_scope = scope_name
+                    break
+        
+        final_class_name = class_name if class_name else current_class_name_in_scope
+        final_struct_name = struct_name if struct_name else current_struct_name_in_scope
+
+        chunks.append({
+            "content": content,
+            "source": os.path.basename(file_path),
+            "start_line": node.start_point[0] + 1,
+            "type": chunk_type,
+            "function_name": func_name,
+            "class_name": final_class_name,
+            "struct_name": final_struct_name,
+            "array_name": array_name,
+            "test_case_function_name": test_case_function_name
+        })
+        processed_ranges.append((node.start_byte, end_byte))
+
+    # Adjacent comments (only whitespace in between) are merged into one run: [first node, end_byte]
+    pending_comment = []
+
+    def flush_pending_comment():
+        start_node, end_byte = pending_comment
+        pending_comment.clear()
+        content = get_range_content(start_node.start_byte, end_byte)
+        # Skip one-line remarks and separator lines; they only add noise to retrieval
+        if len(content.strip()) < MIN_COMMENT_CHUNK_CHARS or not COMMENT_HAS_TEXT_PATTERN.search(content):
+            return
+        add_chunk(start_node, "comment", end_byte=end_byte)
+
+
+    # --- AST Traversal Logic ---
+    # Find every candidate node with a single query run in C instead of stepping a TreeCursor
+    # through every node from Python. Sorting by (start, -end) restores the pre-order the
+    # scope stack and add_chunk rely on: document order, with enclosing nodes first.
+    definition_nodes = [node for node, _ in queries["definitions"].captures(root_node) if node != root_node]
+    definition_nodes.sort(key=lambda n: (n.start_byte, -n.end_byte))
+
+    for node in definition_nodes:
+        if pending_comment and not (node.type == 'comment' and
+                                    not code_bytes[pending_comment[1]:node.start_byte].strip()):
+            flush_pending_comment()
+
+        while scope_stack and node.start_byte >= scope_stack[-1][2]:
+            scope_stack.pop()
+
+        # 1. Class Definitions (Only for C++ files)
+        if node.type == 'class_specifier' and class_query:
+            captures = capture_map(class_query.captures(node))
+            class_name = get_name_from_capture(captures, "class.name")
+            if class_name:
+                add_chunk(node, "class", class_name=class_name)
+                scope_stack.append(("class", class_name, node.end_byte))
+        
+        # 2. Struct Definitions (C and C++)
+        elif node.type == 'struct_specifier' and struct_query:
+            captures = capture_map(struct_query.captures(node))
+            struct_name = get_name_from_capture(captures, "struct.name")
+            if struct_name:
+                add_chunk(node, "struct", struct_name=struct_name)
+                scope_stack.append(("struct", struct_name, node.end_byte))
+
+        elif node.type == 'type_definition' and struct_query:
+            captures = capture_map(struct_query.captures(node))
+            typedef_struct_name = get_name_from_capture(captures, "typedef_struct_name")
+            typedef_alias_name = get_name_from_capture(captures, "typedef_alias_name")
+
+            if typedef_alias_name:
+                add_chunk(node, "struct", struct_name=typedef_alias_name)
+                scope_stack.append(("struct", typedef_alias_name, node.end_byte))
+            elif typedef_struct_name:
+                add_chunk(node, "struct", struct_name=typedef_struct_name)
+                scope_stack.append(("struct", typedef_struct_name, node.end_byte))
+
+
+        # 3. Function Definitions (global and member)
+        elif node.type == 'function_definition' and function_query:
+            func_declarator_node = capture_map(function_query.captures(node)).get("function.declarator_node")
+
+            if func_declarator_node:
+                func_name, scope_name_from_func = get_function_name_and_scope(func_declarator_node)
+                
+                chunk_type = "function"
+                test_case_function_name = ""
+                if is_test_function_name(func_name):
+                    chunk_type = "test_case_function"
+                    test_case_function_name = func_name
+                
+                add_chunk(node, chunk_type, func_name=func_name, test_case_function_name=test_case_function_name,
+                          class_name=scope_name_from_func if scope_name_from_func and current_language == CPP_LANGUAGE else "",
+                          struct_name=scope_name_from_func if scope_name_from_func and current_language == C_LANGUAGE else ""
+                          )
+
+        # 4. Global Array Initializations
+        elif node.type == 'declaration' and global_array_init_query:
+            captures = capture_map(global_array_init_query.captures(node))
+            array_name = get_name_from_capture(captures, "array.name")
+            if array_name and "array.definition" in captures:
+                add_chunk(node, "array_init", array_name=array_name)
+
+        # 5. Comments
+        elif node.type == 'comment' and comment_query:
+            if pending_comment:
+                pending_comment[1] = node.end_byte
+            else:
+                pending_comment.extend([node, node.end_byte])
+
+    if pending_comment:
+        flush_pending_comment()
+    return chunks
+
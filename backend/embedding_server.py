@@ -0,0 +1,124 @@
+# backend/embedding_server.py
+"""
+Shared embedding service. Loads the embedding model once and serves POST /encode, so several
+backend workers (EMBEDDING_SERVER_URL set) use one model instead of loading one each.
+
+Run with: uvicorn backend.embedding_server:app --port 8001
+"""
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Response
+from pydantic import BaseModel
+
+from backend import rag_module
+
+# Requests arriving within BATCH_WAIT_MS of each other are encoded with one model.encode call
+BATCH_WAIT_MS = 5
+MAX_BATCH_SENTENCES = 4096
+EMBEDDING_SERVER_PORT = int(os.getenv("EMBEDDING_SERVER_PORT", "8001"))
+
+# rag_module only loads the model itself when it is not a client of this server
+model = rag_module.model if not rag_module.EMBEDDING_SERVER_URL else rag_module.load_embedding_model()
+
+class EncodeRequest(BaseModel):
+    sentences: list[str]
+
+class EncodeBatcher:
+    """
+    Collects concurrent /encode requests for up to BATCH_WAIT_MS, encodes all their sentences in
+    one call and hands each request its own rows. Batches are encoded one after another, so
+    requests arriving during an encode are coalesced into the next batch.
+    """
+    def __init__(self, max_sentences: int = MAX_BATCH_SENTENCES, wait_ms: int = BATCH_WAIT_MS):
+        self.max_sentences = max_sentences
+        self.wait_seconds = wait_ms / 1000
+        self.queue = None
+        self.worker = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    async def submit(self, sentences: list[str]) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sentences, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            total = len(batch[0][0])
+            deadline = loop.time() + self.wait_seconds
+            while total < self.max_sentences:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                total += len(item[0])
+            await self._encode_batch(batch)
+
+    async def _encode_batch(self, batch):
+        sentences = [sentence for item_sentences, _ in batch for sentence in item_sentences]
+        try:
+            embeddings = await asyncio.to_thread(
+                model.encode,
+                sentences,
+                batch_size=rag_module.ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for item_sentences, future in batch:
+            end = start + len(item_sentences)
+            if not future.done():
+                future.set_result(embeddings[start:end])
+            start = end
+
+encode_batcher = EncodeBatcher()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    encode_batcher.start()
+    yield
+    encode_batcher.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.post("/encode")
+async def encode(request: EncodeRequest):
+    """
+    Returns L2-normalised float32 embeddings as raw bytes, one row per sentence; the row width is
+    in the X-Embedding-Dim header. Raw bytes avoid serialising every float as JSON text.
+    """
+    if not request.sentences:
+        return Response(content=b"", media_type="application/octet-stream", headers={"X-Embedding-Dim": "0"})
+    embeddings = np.ascontiguousarray(await encode_batcher.submit(request.sentences), dtype=np.float32)
+    return Response(
+        content=embeddings.tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Embedding-Dim": str(embeddings.shape[1])}
+    )
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=EMBEDDING_SERVER_PORT)
@@ -1,85 +1,137 @@
 # backend/llm_module.py
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+import hashlib
+import re
+import string
+import functools
+from cachetools import TTLCache
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# google.generativeai pulls in gRPC and protobuf and is slow to import, so it is loaded on first use
+genai = None
+
+@functools.lru_cache(maxsize=1)
+def _load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def _genai():
+    """
+    Imports and configures google.generativeai the first time the LLM is needed.
+    """
+    global genai
+    if genai is None:
+        _load_env()
+        import google.generativeai as g
+        g.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        genai = g
+    return genai
 
 # Model Parameters
 model_name = "gemini-1.5-flash"
 DEFAULT_TEMPERATURE = 0.2
 
-def generate_answer(question: str, chunks_content: list[str], temperature: float = DEFAULT_TEMPERATURE) -> str:
-    """
-    Generates an answer to the question based on provided code chunks.
-    
-    Args:
-        question (str): The user's question.
-        chunks_content (list[str]): A list of code/comment strings (chunk content) to use as context.
-        temperature (float): Controls the randomness of the output. Lower is more deterministic.
-    
-    Returns:
-        str: The generated answer.
-    """
-    context = "\n\n".join(chunks_content)
-    
-    prompt = f"""You are a senior software engineer AI assistant.
-Your goal is to provide accurate, concise, and helpful answers to questions about code, acting as a technical expert.
-
-Instructions:
-1. Explain function behavior line-by-line if a function is asked.
-2. Use ONLY the provided code context to answer the question. Do not use outside knowledge.
-3. If the answer is not available in the provided context, state "I cannot answer this question based on the provided code context."
-4. Read the code context carefully and analyze function names, logic, comments, and code patterns.
-5. Mention function names and file names when applicable.
-6. Generate clear, meaningful, developer-friendly, and context-aware answers.
-7. Maintain a professional and helpful tone.
-
-MERMAID DIAGRAM GENERATION (MANDATORY):
-- You MUST generate a Mermaid diagram for ANY function or logic flow.
-- Use flowchart format: graph TD
-- Use plain, human-readable labels inside nodes.
-- DO NOT include raw code syntax in labels.
-- DO NOT use quotation marks or semicolons in node labels.
-- Simplify code to readable labels like:
-  * Loop from 0 to n
-  * Check if condition is true
-  * Print result
-  * Return value
-- Node types:
-  * A[Process Step] for actions
-  * B{{{{Decision Point}}}} for conditions
-  * C((Start/End)) for entry/exit points
-- Use --> for arrows
-- Use -- Yes --> and -- No --> for decision branches
-
-RESPONSE FORMAT:
+# Static instructions, sent as the model's system instruction
+SYSTEM_PROMPT = """You are a senior software engineer AI assistant answering questions about code.
+
+Rules:
+1. Use ONLY the provided code context. If the answer is not in it, state "I cannot answer this question based on the provided code context."
+2. When asked about a function, explain its behavior line-by-line and mention function and file names.
+3. Be accurate, concise, developer-friendly and professional.
+
+Response format:
 1. Brief explanation of what the code does
 2. Line-by-line breakdown
-3. Mermaid diagram (REQUIRED)
+3. Mermaid diagram (REQUIRED for any function or logic flow)
 4. Summary
 
-Example Mermaid format:
+Mermaid rules: use graph TD with plain, human-readable labels (e.g. Loop from 0 to n, Return value) and no raw code, quotation marks or semicolons in labels.
+A[Step] is an action, B{{Decision}} a condition, C((Start/End)) an entry/exit; use --> and -- Yes --> / -- No --> for branches.
+
+Example:
 ```mermaid
 graph TD
     A((Start)) --> B[Initialize variables]
-    B --> C{{{{Check condition}}}}
+    B --> C{{Check condition}}
     C -- Yes --> D[Execute logic]
-    C -- No --> E[Skip to end]
-    D --> F[Return result]
-    E --> F
-    F --> G((End))
-```
+    C -- No --> E[Return result]
+    D --> E
+    E --> F((End))
+```"""
 
-Code Context:
-```
-{context}
-```
+# Per-call prompt template, split around the code context so only the question needs formatting
+PROMPT_PREFIX = "Code Context:\n```\n"
+PROMPT_SUFFIX_FMT = "\n```\n\nQuestion: {}\n\nAnswer the question using ONLY the code context. Include a Mermaid graph TD diagram."
+
+# Answer cache: bump CACHE_VERSION whenever the prompt changes so stale answers are never served
+CACHE_VERSION = "v2"
+ANSWER_CACHE_MAXSIZE = 1024
+ANSWER_CACHE_TTL_SECONDS = 3600
+answer_cache = TTLCache(maxsize=ANSWER_CACHE_MAXSIZE, ttl=ANSWER_CACHE_TTL_SECONDS)
+answer_cache_lock = asyncio.Lock()
+
+# Micro-batching: questions arriving within BATCH_WAIT_MS of each other share one Gemini request
+MAX_BATCH = 8
+BATCH_WAIT_MS = 40
+BATCHED_ANSWER_MARKER = re.compile(r"^###\s*A(\d+):", re.MULTILINE)
+
+# Keyword -> pattern categories used by generate_fallback_diagram
+FALLBACK_KEYWORD_CATEGORIES = {
+    "def": ("function",), "function": ("function",), "void": ("function",), "int": ("function",),
+    "return": ("function", "output"),
+    "for": ("loop",), "while": ("loop",), "loop": ("loop",),
+    "if": ("condition",), "else": ("condition",), "elif": ("condition",), "switch": ("condition",), "?": ("condition",),
+    "input": ("input",), "scanf": ("input",), "cin": ("input",), "read": ("input",),
+    "print": ("output",), "printf": ("output",), "cout": ("output",), "output": ("output",),
+}
+FALLBACK_CATEGORIES = {category for categories in FALLBACK_KEYWORD_CATEGORIES.values() for category in categories}
+FALLBACK_KEYWORD_PATTERN = re.compile(
+    r"\b(?:" + "|".join(k for k in FALLBACK_KEYWORD_CATEGORIES if k != "?") + r")\b|\?",
+    re.IGNORECASE
+)
+
+# Mermaid node ids for the fallback diagram: A..Z, then AA, AB, ... so ids never collide past 'Z'
+FALLBACK_NODE_LABELS = [
+    (string.ascii_uppercase[i // 26 - 1] if i >= 26 else "") + string.ascii_uppercase[i % 26]
+    for i in range(64)
+]
+
+# Shared model instance, reused across requests so its client and connections are kept warm.
+# SYSTEM_PROMPT is far below Gemini's minimum size for context caching, so it is sent as the
+# system instruction; building the model makes no network call.
+_MODEL = None
+
+def get_model():
+    """
+    Returns the shared Gemini model carrying SYSTEM_PROMPT.
+    """
+    global _MODEL
+    if _MODEL is None:
+        _genai()
+        _MODEL = genai.GenerativeModel(model_name, system_instruction=SYSTEM_PROMPT)
+    return _MODEL
 
-Question: {question}
+def build_prompt(question: str, context: str) -> str:
+    """
+    Builds the per-call part of the prompt: the joined code context and the question.
+    """
+    return PROMPT_PREFIX + context + PROMPT_SUFFIX_FMT.format(question)
 
-Provide your complete response with the mandatory Mermaid diagram:"""
+async def generate_answer(question: str, chunks_content: list[str] | str, temperature: float = DEFAULT_TEMPERATURE) -> str:
+    """
+    Generates an answer to the question based on provided code chunks.
+    
+    Args:
+        question (str): The user's question.
+        chunks_content (list[str] | str): A list of code/comment strings (chunk content) to use as context,
+            or the already joined context string.
+        temperature (float): Controls the randomness of the output. Lower is more deterministic.
+    
+    Returns:
+        str: The generated answer.
+    """
+    context = chunks_content if isinstance(chunks_content, str) else "\n\n".join(chunks_content)
+    prompt = build_prompt(question, context)
 
     # Configure generation with the temperature parameter
     generation_config = {
@@ -87,8 +139,8 @@ Provide your complete response with the mandatory Mermaid diagram:"""
     }
     
     try:
-        model = genai.GenerativeModel(model_name)
-        res = model.generate_content(prompt, stream=False, generation_config=generation_config)
+        model = get_model()
+        res = await model.generate_content_async(prompt, stream=False, generation_config=generation_config)
         
         if res.text:
             response_text = res.text
@@ -104,74 +156,299 @@ Provide your complete response with the mandatory Mermaid diagram:"""
     except Exception as e:
         return f"Error generating response: {str(e)}"
 
+def build_batched_prompt(questions: list[str], context: str) -> str:
+    """
+    Builds one prompt asking several questions about the same code context.
+    """
+    numbered_questions = "\n".join(f"### Q{i}: {q}" for i, q in enumerate(questions, start=1))
+    return f"""Code Context:
+```
+{context}
+```
+
+Answer each question separately using ONLY the code context, each with a Mermaid graph TD diagram.
+Start each answer with a line containing only its marker, e.g. "### A1:" for "### Q1:".
+
+{numbered_questions}"""
+
+def parse_batched_answers(response_text: str, count: int) -> list:
+    """
+    Splits a batched response on its "### A<n>:" markers. Missing answers are returned as None.
+    """
+    answers = [None] * count
+    markers = list(BATCHED_ANSWER_MARKER.finditer(response_text))
+    for i, marker in enumerate(markers):
+        index = int(marker.group(1)) - 1
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(response_text)
+        answer = response_text[marker.end():end].strip()
+        if 0 <= index < count and answer:
+            answers[index] = answer
+    return answers
+
+async def generate_batched_answers(questions: list[str], context: str, temperature: float = DEFAULT_TEMPERATURE) -> list[str]:
+    """
+    Answers several questions about the same code context with a single Gemini request.
+    Questions the model did not answer under their marker are retried individually, and if the
+    batched request fails altogether every question is answered on its own.
+    """
+    generation_config = {
+        "temperature": temperature
+    }
+    try:
+        model = get_model()
+        res = await model.generate_content_async(build_batched_prompt(questions, context), stream=False, generation_config=generation_config)
+        # res.text raises when the response was blocked, so read it inside the try as well
+        answers = parse_batched_answers(res.text or "", len(questions))
+    except Exception as e:
+        print(f"Batched Gemini request failed, answering {len(questions)} questions individually: {e}")
+        return list(await asyncio.gather(*(
+            generate_answer(question, context, temperature=temperature) for question in questions
+        )))
+
+    for i, answer in enumerate(answers):
+        if answer is None:
+            answers[i] = await generate_answer(questions[i], context, temperature=temperature)
+        elif "```mermaid" not in answer:
+            answers[i] = answer + "\n\n" + generate_fallback_diagram(context, questions[i])
+    return answers
+
+class QueryBatcher:
+    """
+    Collects questions submitted within a short window and answers those sharing the same
+    temperature and code context with one Gemini request.
+    """
+    def __init__(self, max_batch: int = MAX_BATCH, wait_ms: int = BATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.wait_seconds = wait_ms / 1000
+        self.queue = None
+        self.worker = None
+        # Strong references to in-flight group tasks, so they are not garbage collected mid-request
+        self.tasks = set()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    async def submit(self, question: str, chunks_content: list[str], temperature: float = DEFAULT_TEMPERATURE) -> str:
+        context = "\n\n".join(chunks_content)
+        if self.worker is None:
+            # Batcher not running (e.g. used outside the FastAPI app), answer directly
+            return await generate_answer(question, context, temperature=temperature)
+
+        context_hash = hashlib.blake2b(context.encode(), digest_size=16).hexdigest()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((temperature, context_hash), question, context, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # Hold the first question for the window even when alone: concurrent requests reach
+            # the queue one after another, so an empty queue here does not mean no one else is coming
+            deadline = loop.time() + self.wait_seconds
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Only batch requests with identical temperature and context to keep answers deterministic
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0], []).append(item)
+            for items in groups.values():
+                task = asyncio.create_task(self._answer_group(items))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def _answer_group(self, items):
+        (temperature, _), _, context, _ = items[0]
+        questions = [question for _, question, _, _ in items]
+        try:
+            if len(items) == 1:
+                answers = [await generate_answer(questions[0], context, temperature=temperature)]
+            else:
+                print(f"Answering a batch of {len(items)} questions with one Gemini request.")
+                answers = await generate_batched_answers(questions, context, temperature=temperature)
+        except Exception as e:
+            for _, _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, _, future), answer in zip(items, answers):
+            if not future.done():
+                future.set_result(answer)
+
+query_batcher = QueryBatcher()
+
+def make_answer_cache_key(question: str, chunk_ids: list[str], temperature: float) -> str:
+    """
+    Builds a stable cache key from the question, the retrieved chunk ids and the temperature.
+    """
+    digest = hashlib.blake2b(
+        question.encode() + b"|" + b"|".join(sorted(cid.encode() for cid in chunk_ids)) + f"|{temperature:.2f}".encode(),
+        digest_size=16
+    ).hexdigest()
+    return f"{CACHE_VERSION}:{digest}"
+
+def is_cacheable_answer(answer: str) -> bool:
+    """
+    False for the error placeholders returned when generation fails.
+    """
+    return not answer.startswith("Error generating response") and answer != "No answer could be generated."
+
+async def generate_answer_cached(question: str, chunks_content: list[str], chunk_ids: list[str], temperature: float = DEFAULT_TEMPERATURE) -> str:
+    """
+    Returns a cached answer for the same question over the same chunks, generating it on a miss.
+    
+    Args:
+        question (str): The user's question.
+        chunks_content (list[str]): A list of code/comment strings (chunk content) to use as context.
+        chunk_ids (list[str]): ChromaDB ids of the retrieved chunks, used for the cache key.
+        temperature (float): Controls the randomness of the output. Lower is more deterministic.
+    
+    Returns:
+        str: The generated (or cached) answer.
+    """
+    key = make_answer_cache_key(question, chunk_ids, temperature)
+    async with answer_cache_lock:
+        cached = answer_cache.get(key)
+    if cached is not None:
+        print(f"Answer cache hit for query: '{question}'")
+        return cached
+
+    answer = await query_batcher.submit(question, chunks_content, temperature)
+
+    # Only keep real answers; errors should be retried on the next request
+    if is_cacheable_answer(answer):
+        async with answer_cache_lock:
+            answer_cache[key] = answer
+    return answer
+
+async def stream_answer(question: str, chunks_content: list[str] | str, temperature: float = DEFAULT_TEMPERATURE):
+    """
+    Streams an answer to the question as Gemini produces it.
+    
+    Args:
+        question (str): The user's question.
+        chunks_content (list[str] | str): A list of code/comment strings (chunk content) to use as context,
+            or the already joined context string.
+        temperature (float): Controls the randomness of the output. Lower is more deterministic.
+    
+    Yields:
+        str: Pieces of the generated answer, in order.
+    """
+    context = chunks_content if isinstance(chunks_content, str) else "\n\n".join(chunks_content)
+    prompt = build_prompt(question, context)
+
+    generation_config = {
+        "temperature": temperature
+    }
+
+    # Keep what has been sent so the fallback diagram check can run once the stream ends
+    streamed_parts = []
+    try:
+        model = get_model()
+        response = await model.generate_content_async(prompt, stream=True, generation_config=generation_config)
+
+        async for chunk in response:
+            if chunk.text:
+                streamed_parts.append(chunk.text)
+                yield chunk.text
+
+        if not streamed_parts:
+            yield "No answer could be generated."
+            return
+
+        # Force diagram generation if missing from the full streamed answer
+        if "```mermaid" not in "".join(streamed_parts):
+            yield "\n\n" + generate_fallback_diagram(context, question)
+
+    except Exception as e:
+        yield f"Error generating response: {str(e)}"
+
 def generate_fallback_diagram(context: str, question: str) -> str:
     """
     Generates a fallback Mermaid diagram when LLM fails to create one.
     """
     # Analyze the code to create appropriate diagram
-    context_lower = context.lower()
+    parts = ["## Mermaid Diagram:\n```mermaid\ngraph TD\n    A((Start))"]
     
-    diagram = "## Mermaid Diagram:\n```mermaid\ngraph TD\n    A((Start))"
+    # Detect common patterns in a single pass over the context
+    hits = set()
+    for match in FALLBACK_KEYWORD_PATTERN.finditer(context):
+        hits.update(FALLBACK_KEYWORD_CATEGORIES[match.group(0).lower()])
+        if len(hits) == len(FALLBACK_CATEGORIES):
+            break
     
-    # Detect common patterns
-    has_function = any(keyword in context_lower for keyword in ['def ', 'function', 'void ', 'int ', 'return'])
-    has_loop = any(keyword in context_lower for keyword in ['for', 'while', 'loop'])
-    has_condition = any(keyword in context_lower for keyword in ['if', 'else', 'elif', '?', 'switch'])
-    has_input = any(keyword in context_lower for keyword in ['input', 'scanf', 'cin', 'read'])
-    has_output = any(keyword in context_lower for keyword in ['print', 'printf', 'cout', 'output', 'return'])
+    has_function = "function" in hits
+    has_loop = "loop" in hits
+    has_condition = "condition" in hits
+    has_input = "input" in hits
+    has_output = "output" in hits
     
-    current_node = 'A'
+    # Node ids are indexes into FALLBACK_NODE_LABELS; 0 is the Start node
+    labels = FALLBACK_NODE_LABELS
+    current_node = 0
     
     if has_function:
-        next_node = chr(ord(current_node) + 1)
-        diagram += f" --> {next_node}[Initialize function parameters]"
+        next_node = current_node + 1
+        parts.append(f" --> {labels[next_node]}[Initialize function parameters]")
         current_node = next_node
     
     if has_input:
-        next_node = chr(ord(current_node) + 1)
-        diagram += f"\n    {current_node} --> {next_node}[Read input values]"
+        next_node = current_node + 1
+        parts.append(f"\n    {labels[current_node]} --> {labels[next_node]}[Read input values]")
         current_node = next_node
     
     if has_condition:
-        next_node = chr(ord(current_node) + 1)
-        diagram += f"\n    {current_node} --> {next_node}{{{{Check condition}}}}"
-        condition_node = next_node
+        condition_node = current_node + 1
+        parts.append(f"\n    {labels[current_node]} --> {labels[condition_node]}{{{{Check condition}}}}")
         
         # True branch
-        true_node = chr(ord(next_node) + 1)
-        diagram += f"\n    {condition_node} -- Yes --> {true_node}[Execute true branch]"
+        true_node = condition_node + 1
+        parts.append(f"\n    {labels[condition_node]} -- Yes --> {labels[true_node]}[Execute true branch]")
         
         # False branch  
-        false_node = chr(ord(next_node) + 2)
-        diagram += f"\n    {condition_node} -- No --> {false_node}[Execute false branch]"
+        false_node = condition_node + 2
+        parts.append(f"\n    {labels[condition_node]} -- No --> {labels[false_node]}[Execute false branch]")
         
-        current_node = chr(ord(next_node) + 3)
-        diagram += f"\n    {true_node} --> {current_node}[Continue execution]"
-        diagram += f"\n    {false_node} --> {current_node}"
+        current_node = condition_node + 3
+        parts.append(f"\n    {labels[true_node]} --> {labels[current_node]}[Continue execution]")
+        parts.append(f"\n    {labels[false_node]} --> {labels[current_node]}")
     
     if has_loop:
-        next_node = chr(ord(current_node) + 1)
-        diagram += f"\n    {current_node} --> {next_node}[Initialize loop]"
-        current_node = next_node
+        loop_init = current_node + 1
+        parts.append(f"\n    {labels[current_node]} --> {labels[loop_init]}[Initialize loop]")
         
-        loop_check = chr(ord(current_node) + 1)
-        diagram += f"\n    {current_node} --> {loop_check}{{{{Loop condition}}}}"
+        loop_check = loop_init + 1
+        parts.append(f"\n    {labels[loop_init]} --> {labels[loop_check]}{{{{Loop condition}}}}")
         
-        loop_body = chr(ord(current_node) + 2)
-        diagram += f"\n    {loop_check} -- Yes --> {loop_body}[Execute loop body]"
-        diagram += f"\n    {loop_body} --> {loop_check}"
+        loop_body = loop_init + 2
+        parts.append(f"\n    {labels[loop_check]} -- Yes --> {labels[loop_body]}[Execute loop body]")
+        parts.append(f"\n    {labels[loop_body]} --> {labels[loop_check]}")
         
-        current_node = chr(ord(current_node) + 3)
-        diagram += f"\n    {loop_check} -- No --> {current_node}[Exit loop]"
+        current_node = loop_init + 3
+        parts.append(f"\n    {labels[loop_check]} -- No --> {labels[current_node]}[Exit loop]")
     
     if has_output:
-        next_node = chr(ord(current_node) + 1)
-        diagram += f"\n    {current_node} --> {next_node}[Generate output]"
+        next_node = current_node + 1
+        parts.append(f"\n    {labels[current_node]} --> {labels[next_node]}[Generate output]")
         current_node = next_node
     
     # End node
-    end_node = chr(ord(current_node) + 1)
-    diagram += f"\n    {current_node} --> {end_node}((End))"
-    diagram += "\n```"
+    end_node = current_node + 1
+    parts.append(f"\n    {labels[current_node]} --> {labels[end_node]}((End))")
+    parts.append("\n```")
     
-    return diagram
\ No newline at end of file
+    return "".join(parts)
\ No newline at end of file
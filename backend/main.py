@@ -1,10 +1,16 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+import json
+import asyncio
+import tempfile
+import anyio
+import sqlite3
 import chromadb
-import shutil # For clearing the database directory
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional # Ensure Optional is imported
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -13,33 +19,102 @@ from backend import llm_module
 
 # Define the path to your ChromaDB data
 CHROMA_DB_PATH = "data/chroma_db"
-COLLECTION_NAME = "code_chunks" # Must match COLLECTION_NAME in rag_module.py
+# Rough prompt budget for retrieved code, estimated at ~4 characters per token
+MAX_CONTEXT_TOKENS = 6000
+NO_CONTEXT_ANSWER = "I cannot answer this question based on the provided code context. No relevant code chunks were found."
+UPLOAD_READ_SIZE = 64 * 1024 # Bytes read per step when streaming uploads to disk
+# Uploads up to this size are parsed from memory; Starlette already holds them there rather than
+# in a spooled file, so a temporary copy would only add a disk round-trip
+IN_MEMORY_UPLOAD_MAX_BYTES = 1024 * 1024
+WORKER_THREADS = 64 # Threads available for blocking work such as ChromaDB queries
+PREFETCH_MAX_SESSIONS = 1024 # Upper bound on sessions holding a prefetched retrieval
+COLLECTION_NAME = rag_module.COLLECTION_NAME # Single source of truth lives in rag_module.py
+# Optional ChromaDB server. When set, the backend talks to it over HTTP instead of opening
+# CHROMA_DB_PATH itself, and retrieval uses ChromaDB's async client.
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+async_chroma_client = None
+
+def enable_chroma_wal():
+    """
+    Switches ChromaDB's SQLite file to write-ahead logging, so inserts append to the WAL instead
+    of rewriting a rollback journal per transaction and queries are not blocked while writing.
+    The journal mode is stored in the database file, which is why a short-lived connection made
+    before the client opens it is enough. Connection-level pragmas (synchronous, temp_store,
+    mmap_size) cannot be set this way because ChromaDB owns its connections.
+    """
+    db_file = os.path.join(CHROMA_DB_PATH, "chroma.sqlite3")
+    try:
+        conn = sqlite3.connect(db_file)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Could not enable WAL for {db_file}: {e}")
+
+def open_chroma_collection():
+    """
+    Opens the ChromaDB client (persistent, or HTTP when CHROMA_HOST is set) and the code chunk
+    collection on rag_module.
+    """
+    if CHROMA_HOST:
+        rag_module.client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    else:
+        os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+        enable_chroma_wal()
+        rag_module.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    rag_module.collection = rag_module.client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        # Embeddings are always computed by rag_module.model and passed in explicitly
+        embedding_function=None
+    )
+    rag_module.answer_cache = rag_module.AnswerCache(rag_module.client)
+
+async def open_async_chroma_collection():
+    """
+    Points rag_module.async_collection at the server's collection. Only used with CHROMA_HOST.
+    """
+    global async_chroma_client
+    if async_chroma_client is None:
+        async_chroma_client = await chromadb.AsyncHttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    rag_module.async_collection = await async_chroma_client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=None
+    )
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize ChromaDB client and collection
+    # Startup: Give blocking calls (ChromaDB queries, sync endpoints) a larger thread pool
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS))
+    anyio.to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
+
+    # Initialize ChromaDB client and collection
     print("Initializing ChromaDB client...")
-    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    open_chroma_collection()
+    if CHROMA_HOST:
+        await open_async_chroma_collection()
     
-    rag_module.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-    rag_module.collection = rag_module.client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        embedding_function=rag_module.EMBEDDING_FUNCTION_CHROMA # Pass the embedding function
-    )
+    llm_module.query_batcher.start()
     
     print("Application startup complete. ChromaDB ready for operations.")
     yield
     # Shutdown: No specific cleanup needed for persistent ChromaDB
+    llm_module.query_batcher.stop()
 
-app = FastAPI(lifespan=lifespan)
+# orjson serializes the large retrieved_context payloads much faster than the stdlib json encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
-# Add CORS middleware to allow OPTIONS requests
+# Add CORS middleware for the browser frontend. Origins, methods and headers are explicit,
+# and max_age lets browsers cache the preflight result instead of repeating it per request.
+ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000").split(",")
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # You can restrict this to your frontend's origin
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "X-Session-Id"],
+    max_age=86400,
 )
 
 class QueryRequest(BaseModel):
@@ -48,6 +123,7 @@ class QueryRequest(BaseModel):
     top_k: int = rag_module.DEFAULT_TOP_K
     similarity_threshold: float = rag_module.DEFAULT_SIMILARITY_THRESHOLD
     filter_type: Optional[str] = None # Added: Optional filter for chunk type
+    prefetch_query: Optional[str] = None # Likely next question; its retrieval runs while this answer is generated
 
 class CodeChunk(BaseModel):
     content: str
@@ -64,29 +140,220 @@ class QueryResponse(BaseModel):
     retrieved_context: List[CodeChunk]
     debug_info: dict = {}
 
+def format_code_chunks(retrieved_chunks: List[dict]) -> List[CodeChunk]:
+    """
+    Converts retrieved chunk dicts into CodeChunk models for API responses.
+    """
+    # The CodeChunk model expects specific Optional fields to be handled
+    response_chunks = []
+    for chunk in retrieved_chunks:
+        response_chunks.append(CodeChunk(
+            content=chunk['content'],
+            source=chunk['source'],
+            start_line=chunk['start_line'],
+            type=chunk['type'],
+            distance=chunk.get('distance'), # Optional
+            function_name=chunk.get('function_name') or None, # Ensure None if empty string for Pydantic Optional
+            class_name=chunk.get('class_name') or None,     # Ensure None if empty string for Pydantic Optional
+            struct_name=chunk.get('struct_name') or None    # Ensure None if empty string for Pydantic Optional
+        ))
+    return response_chunks
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token) that avoids a count_tokens round-trip.
+    """
+    return len(text) // 4
+
+def fit_chunks_to_context_budget(retrieved_chunks: List[dict], max_tokens: int = MAX_CONTEXT_TOKENS):
+    """
+    Keeps the most similar chunks whose combined size fits the token budget and drops the rest.
+    Chunks arrive sorted by distance, so the least similar ones are dropped first.
+    The first chunk is always kept so there is some context to answer from.
+    
+    Returns:
+        tuple[list[dict], list[dict]]: The kept chunks and the dropped chunks.
+    """
+    total_tokens = 0
+    for i, chunk in enumerate(retrieved_chunks):
+        total_tokens += estimate_tokens(chunk['content'])
+        if total_tokens > max_tokens and i > 0:
+            return retrieved_chunks[:i], retrieved_chunks[i:]
+    return retrieved_chunks, []
+
+def summarize_chunk(chunk: dict) -> dict:
+    """
+    Short description of a retrieved chunk for debug_info.
+    """
+    name = chunk.get('function_name') or chunk.get('class_name') or chunk.get('struct_name')
+    return {
+        "type": chunk['type'],
+        "name": name if name else "N/A",
+        "source": chunk.get('source_basename') or os.path.basename(chunk['source']), # Fallback for chunks indexed before source_basename existed
+        "line": chunk['start_line'],
+        "distance": f"{chunk['distance']:.4f}"
+    }
+
+# Retrievals started ahead of time, per client session: session_id -> (retrieval key, asyncio.Task)
+prefetch_tasks = {}
+
+def retrieval_key(query: str, request: QueryRequest) -> tuple:
+    """
+    Identifies a retrieval by its query, the request's retrieval settings and the collection's
+    cache generation, so a retrieval prefetched before an upload or clear is never reused.
+    """
+    return (query, request.top_k, request.similarity_threshold, request.filter_type,
+            rag_module.retrieval_cache_generation())
+
+async def retrieve_chunks(request: QueryRequest, session_id: Optional[str]) -> List[dict]:
+    """
+    Retrieves chunks for the request, reusing the retrieval prefetched for this session when it matches.
+    """
+    prefetched = prefetch_tasks.pop(session_id, None) if session_id else None
+    if prefetched:
+        key, task = prefetched
+        if key == retrieval_key(request.query, request):
+            try:
+                print(f"Using prefetched retrieval for query: '{request.query}'")
+                return await task
+            except Exception as e:
+                print(f"Prefetched retrieval failed, querying again: {e}")
+        else:
+            task.cancel()
+
+    # Chroma's client is synchronous, so run the query off the event loop
+    return await rag_module.retrieve_relevant_chunks_async(
+        request.query, 
+        top_k=request.top_k, 
+        similarity_threshold=request.similarity_threshold,
+        filter_type=request.filter_type # Pass the new filter_type
+    )
+
+def start_prefetch(request: QueryRequest, session_id: Optional[str]):
+    """
+    Starts retrieval for request.prefetch_query in the background so the next /ask/ can reuse it.
+    """
+    if not (session_id and request.prefetch_query):
+        return
+
+    previous = prefetch_tasks.pop(session_id, None)
+    if previous:
+        previous[1].cancel()
+    elif len(prefetch_tasks) >= PREFETCH_MAX_SESSIONS:
+        # Forget the oldest session's prefetch to keep memory bounded
+        oldest_session = next(iter(prefetch_tasks))
+        prefetch_tasks.pop(oldest_session)[1].cancel()
+
+    task = asyncio.create_task(rag_module.retrieve_relevant_chunks_async(
+        request.prefetch_query,
+        top_k=request.top_k,
+        similarity_threshold=request.similarity_threshold,
+        filter_type=request.filter_type
+    ))
+    # A prefetch that fails and is then replaced or evicted is never awaited; retrieve its
+    # exception so asyncio does not log "Task exception was never retrieved"
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    prefetch_tasks[session_id] = (retrieval_key(request.prefetch_query, request), task)
+
+def sse_event(data, event: Optional[str] = None) -> str:
+    """
+    Formats a single Server-Sent Event. Data is JSON-encoded so newlines in tokens stay intact.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
 @app.get("/")
 async def read_root():
     return {"message": "Chat with Your Code API is running!"}
 
+# .hpp is parsed as C++; the React upload already offers it
+ALLOWED_UPLOAD_SUFFIXES = ('.c', '.cpp', '.h', '.hpp')
+
+async def save_upload_to_temp(file: UploadFile) -> str:
+    """
+    Streams an upload to a temporary file in fixed-size pieces instead of reading it all into
+    memory. Returns the temporary path; the caller removes it.
+    """
+    file_size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=rag_module.upload_suffix(file.filename)) as temp_f:
+        try:
+            while chunk := await file.read(UPLOAD_READ_SIZE):
+                temp_f.write(chunk)
+                file_size += len(chunk)
+        except BaseException:
+            temp_f.close()
+            os.unlink(temp_f.name)
+            raise
+    print(f"Received file: {file.filename}, size: {file_size} bytes")
+    return temp_f.name
+
+async def read_upload(file: UploadFile):
+    """
+    Returns a small upload's content as bytes, or for larger (or unsized) uploads the path of a
+    temporary copy, which the caller removes.
+    """
+    if file.size is not None and file.size <= IN_MEMORY_UPLOAD_MAX_BYTES:
+        content = await file.read()
+        print(f"Received file: {file.filename}, size: {len(content)} bytes")
+        return content
+    return await save_upload_to_temp(file)
+
 @app.post("/upload_code_file")
 async def upload_code_file(file: UploadFile = File(...)):
     """
     Receives an uploaded code file, processes it, and stores its chunks in ChromaDB.
     """
-    if not file.filename.endswith(('.c', '.cpp', '.h')):
-        raise HTTPException(status_code=400, detail="Only .c, .cpp, and .h files are allowed.")
+    if not file.filename.endswith(ALLOWED_UPLOAD_SUFFIXES):
+        raise HTTPException(status_code=400, detail="Only .c, .cpp, .h, and .hpp files are allowed.")
     
+    source = None
     try:
-        file_content_bytes = await file.read()
-        print(f"Received file: {file.filename}, size: {len(file_content_bytes)} bytes")
+        source = await read_upload(file)
         
-        # Process and store the uploaded file
-        rag_module.process_and_store_uploaded_file(file_content_bytes, file.filename)
+        # Parsing, encoding and the ChromaDB insert are blocking, so keep them off the event loop
+        if isinstance(source, bytes):
+            await asyncio.to_thread(rag_module.process_and_store_uploaded_file, source, file.filename)
+        else:
+            await asyncio.to_thread(rag_module.process_and_store_uploaded_path, source, file.filename)
         
         return {"message": f"File '{file.filename}' processed and indexed successfully."}
     except Exception as e:
         print(f"Error processing uploaded file {file.filename}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to process file: {e}")
+    finally:
+        if isinstance(source, str) and os.path.exists(source):
+            os.unlink(source)
+
+@app.post("/upload_code_files")
+async def upload_code_files(files: List[UploadFile] = File(...)):
+    """
+    Receives several code files in one multipart request and indexes them together: small files
+    are parsed from memory, large uploads are split across extraction worker processes, one file
+    per task, and all files share one embedding and ChromaDB insertion pipeline.
+    """
+    rejected = [file.filename for file in files if not file.filename.endswith(ALLOWED_UPLOAD_SUFFIXES)]
+    if rejected:
+        raise HTTPException(status_code=400, detail=f"Only .c, .cpp, .h, and .hpp files are allowed: {', '.join(rejected)}")
+
+    sources = []
+    try:
+        for file in files:
+            sources.append(await read_upload(file))
+
+        # Parsing and encoding are CPU-bound, so keep them off the event loop
+        await asyncio.to_thread(
+            rag_module.process_many_files,
+            [(source, file.filename) for source, file in zip(sources, files)]
+        )
+
+        return {"message": f"{len(files)} files processed and indexed successfully."}
+    except Exception as e:
+        print(f"Error processing uploaded files: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process files: {e}")
+    finally:
+        for source in sources:
+            if isinstance(source, str) and os.path.exists(source):
+                os.unlink(source)
 
 @app.post("/clear_codebase")
 async def clear_codebase():
@@ -94,21 +361,18 @@ async def clear_codebase():
     Clears all data from the ChromaDB collection.
     """
     try:
-        if os.path.exists(CHROMA_DB_PATH):
-            shutil.rmtree(CHROMA_DB_PATH)
-            print(f"Cleared ChromaDB at {CHROMA_DB_PATH}")
-            
-            # Re-initialize the collection after clearing
-            # Need to ensure the directory exists before re-initializing
-            os.makedirs(CHROMA_DB_PATH, exist_ok=True) 
-            rag_module.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-            rag_module.collection = rag_module.client.get_or_create_collection(
-                name=COLLECTION_NAME,
-                embedding_function=rag_module.EMBEDDING_FUNCTION_CHROMA
-            )
-            print("ChromaDB re-initialized after clearing.")
-        else:
-            print("ChromaDB directory does not exist, no clearing needed.")
+        # Drop only this collection's data and recreate it empty, keeping the client open
+        rag_module.client.delete_collection(COLLECTION_NAME)
+        rag_module.collection = rag_module.client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=None
+        )
+        if CHROMA_HOST:
+            # The recreated collection has a new id, so the async handle must be refreshed too
+            await open_async_chroma_collection()
+        # Also writes the answer cache's new generation to ChromaDB, so keep it off the event loop
+        await asyncio.to_thread(rag_module.invalidate_retrieval_cache)
+        print(f"Cleared ChromaDB collection '{COLLECTION_NAME}'.")
         
         return {"message": "ChromaDB codebase cleared successfully."}
     except Exception as e:
@@ -116,68 +380,83 @@ async def clear_codebase():
         raise HTTPException(status_code=500, detail=f"Failed to clear codebase: {e}")
 
 
+def answer_cache_params(request: QueryRequest) -> dict:
+    """
+    Request settings a cached answer must match, plus the prompt version it was generated with.
+    """
+    return {
+        "top_k": request.top_k,
+        "similarity_threshold": request.similarity_threshold,
+        "filter_type": request.filter_type or "",
+        "temperature": request.temperature,
+        "prompt_version": llm_module.CACHE_VERSION
+    }
+
 @app.post("/ask/", response_model=QueryResponse)
-async def ask_question(request: QueryRequest):
+async def ask_question(request: QueryRequest, x_session_id: Optional[str] = Header(default=None)):
     try:
+        # A near-identical question answered before skips retrieval and the LLM altogether
+        cache_params = answer_cache_params(request)
+        cached, cache_generation = await asyncio.to_thread(rag_module.answer_cache.lookup, request.query, cache_params)
+        if cached is not None:
+            print(f"Semantic answer cache hit for query: '{request.query}'")
+            start_prefetch(request, x_session_id)
+            answer, response = cached
+            return QueryResponse(answer=answer, **response)
+
         # Retrieve relevant code chunks, passing filter_type
-        retrieved_chunks = rag_module.retrieve_relevant_chunks(
-            request.query, 
-            top_k=request.top_k, 
-            similarity_threshold=request.similarity_threshold,
-            filter_type=request.filter_type # Pass the new filter_type
-        )
+        retrieved_chunks = await retrieve_chunks(request, x_session_id)
+        
+        # Retrieve chunks for the expected follow-up while the answer is generated
+        start_prefetch(request, x_session_id)
+        
+        # Nothing to answer from: return the canned answer before any formatting work
+        if not retrieved_chunks:
+            print("\nDEBUG: No chunks found to send to LLM.")
+            return QueryResponse(
+                answer=NO_CONTEXT_ANSWER,
+                retrieved_context=[],
+                debug_info={
+                    "retrieved_chunk_count": 0,
+                    "query_top_k": request.top_k,
+                    "query_similarity_threshold": request.similarity_threshold,
+                    "llm_temperature": request.temperature,
+                    "filter_type_applied": request.filter_type,
+                    "retrieved_chunks_summary": [],
+                    "dropped_chunks": []
+                }
+            )
+        
+        # Keep the prompt within the context budget, dropping the least similar chunks first
+        retrieved_chunks, dropped_chunks = fit_chunks_to_context_budget(retrieved_chunks)
+        if dropped_chunks:
+            print(f"Dropped {len(dropped_chunks)} chunks to stay within {MAX_CONTEXT_TOKENS} context tokens.")
         
         # Prepare list of chunk contents for the LLM
         chunks_for_llm_context = [chunk['content'] for chunk in retrieved_chunks]
 
         # ADD THIS BLOCK FOR DEBUGGING
-        if chunks_for_llm_context:
-            print("\nDEBUG: Chunks content being sent to LLM:")
-            for i, content in enumerate(chunks_for_llm_context):
-                print(f"  Chunk {i+1} content (first 200 chars):\n{content[:200]}...")
-            print("--- End of Chunks for LLM ---\n")
-        else:
-            print("\nDEBUG: No chunks found to send to LLM.")
+        print("\nDEBUG: Chunks content being sent to LLM:")
+        for i, content in enumerate(chunks_for_llm_context):
+            print(f"  Chunk {i+1} content (first 200 chars):\n{content[:200]}...")
+        print("--- End of Chunks for LLM ---\n")
         # END DEBUG BLOCK
 
-        if not chunks_for_llm_context: # Check if the list is empty
-            answer = "I cannot answer this question based on the provided code context. No relevant code chunks were found."
-        else:
-            # Generate answer using the LLM
-            answer = llm_module.generate_answer(
-                request.query, 
-                chunks_for_llm_context, # Pass the list of content strings
-                temperature=request.temperature
-            )
+        # Generate answer using the LLM (served from the answer cache when possible)
+        answer = await llm_module.generate_answer_cached(
+            request.query, 
+            chunks_for_llm_context, # Pass the list of content strings
+            [chunk['id'] for chunk in retrieved_chunks],
+            temperature=request.temperature
+        )
 
         # Format retrieved_context for the API response model
-        # The CodeChunk model expects specific Optional fields to be handled
-        response_chunks = []
-        for chunk in retrieved_chunks:
-            response_chunks.append(CodeChunk(
-                content=chunk['content'],
-                source=chunk['source'],
-                start_line=chunk['start_line'],
-                type=chunk['type'],
-                distance=chunk.get('distance'), # Optional
-                function_name=chunk.get('function_name') or None, # Ensure None if empty string for Pydantic Optional
-                class_name=chunk.get('class_name') or None,     # Ensure None if empty string for Pydantic Optional
-                struct_name=chunk.get('struct_name') or None    # Ensure None if empty string for Pydantic Optional
-            ))
+        response_chunks = format_code_chunks(retrieved_chunks)
         
         # Optionally, enhance debug_info with retrieved chunk types/names
-        debug_chunks_summary = []
-        for chunk in retrieved_chunks:
-            name = chunk.get('function_name') or chunk.get('class_name') or chunk.get('struct_name')
-            debug_chunks_summary.append({
-                "type": chunk['type'],
-                "name": name if name else "N/A",
-                "source": os.path.basename(chunk['source']),
-                "line": chunk['start_line'],
-                "distance": f"{chunk['distance']:.4f}"
-            })
-
-        return QueryResponse(
+        debug_chunks_summary = [summarize_chunk(chunk) for chunk in retrieved_chunks]
+
+        response = QueryResponse(
             answer=answer,
             retrieved_context=response_chunks,
             debug_info={
@@ -186,9 +465,16 @@ async def ask_question(request: QueryRequest):
                 "query_similarity_threshold": request.similarity_threshold,
                 "llm_temperature": request.temperature,
                 "filter_type_applied": request.filter_type, # Added debug info
-                "retrieved_chunks_summary": debug_chunks_summary # Added detailed summary
+                "retrieved_chunks_summary": debug_chunks_summary, # Added detailed summary
+                "dropped_chunks": [summarize_chunk(chunk) for chunk in dropped_chunks]
             }
         )
+        if llm_module.is_cacheable_answer(answer):
+            await asyncio.to_thread(
+                rag_module.answer_cache.store, request.query, cache_params, answer,
+                response.model_dump(include={"retrieved_context", "debug_info"}), cache_generation
+            )
+        return response
 
     except Exception as e:
         print(f"An error occurred in /ask/: {e}")
@@ -197,5 +483,43 @@ async def ask_question(request: QueryRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
 
+@app.post("/ask/stream/")
+async def ask_question_stream(request: QueryRequest, x_session_id: Optional[str] = Header(default=None)):
+    """
+    Streams the answer as Server-Sent Events: a "context" event with the retrieved chunks,
+    then one "token" event per generated piece of text, then a final "done" event.
+    """
+    try:
+        retrieved_chunks = await retrieve_chunks(request, x_session_id)
+        start_prefetch(request, x_session_id)
+    except Exception as e:
+        print(f"An error occurred in /ask/stream/: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
+
+    retrieved_chunks, dropped_chunks = fit_chunks_to_context_budget(retrieved_chunks)
+
+    chunks_for_llm_context = [chunk['content'] for chunk in retrieved_chunks]
+    response_chunks = format_code_chunks(retrieved_chunks)
+
+    async def event_stream():
+        yield sse_event([chunk.model_dump() for chunk in response_chunks], event="context")
+
+        if not chunks_for_llm_context:
+            yield sse_event(NO_CONTEXT_ANSWER, event="token")
+        else:
+            async for token in llm_module.stream_answer(
+                request.query,
+                chunks_for_llm_context,
+                temperature=request.temperature
+            ):
+                yield sse_event(token, event="token")
+
+        yield sse_event({
+            "retrieved_chunk_count": len(retrieved_chunks),
+            "dropped_chunks": [summarize_chunk(chunk) for chunk in dropped_chunks]
+        }, event="done")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
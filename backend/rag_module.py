@@ -1,559 +1,754 @@
 import os
+import io
+import logging
 import json
+import hashlib
+import sqlite3
 import uuid
-import re
-import tempfile
+import time
+from functools import lru_cache
+import asyncio
+import threading
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 import chromadb
-from chromadb.utils import embedding_functions
 from typing import List, Dict, Any, Optional
 
 from dotenv import load_dotenv
 
-import tree_sitter
-from tree_sitter_languages import get_language
+from backend.code_chunker import extract_code_chunks, extract_code_chunks_from_source, init_parsers
 
 load_dotenv()
 
-# Load model for embeddings
-model = SentenceTransformer('all-MiniLM-L6-v2')
-EMBEDDING_FUNCTION_CHROMA = embedding_functions.SentenceTransformerEmbeddingFunction(model_name='all-MiniLM-L6-v2')
+# Per-query retrieval details go to this logger at DEBUG level, so they cost nothing by default
+log = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_MAX_SEQ_LENGTH = 256 # Same truncation as the SentenceTransformer model
+ONNX_MODEL_PATH = "data/onnx/all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = 64
+ENCODE_SLAB_SIZE = 1000 # Chunks per encode call while ChromaDB inserts run in the background
+# Chunks per collection.upsert call: each call has fixed overhead, so fewer and larger is faster
+CHROMA_ADD_BATCH_SIZE = 1000
+CHROMA_ADD_FALLBACK_BATCH_SIZE = 100
+# Extraction (pure Python plus tree-sitter, which holds the GIL) only goes parallel in worker
+# processes. Spawned workers import backend.code_chunker alone, never the embedding model, but
+# each costs an interpreter start, so smaller uploads are extracted in this process.
+PARALLEL_EXTRACT_MIN_BYTES = 1024 * 1024
+# Optional shared embedding service (backend/embedding_server.py). When set, this process sends
+# sentences there instead of loading its own copy of the model.
+EMBEDDING_SERVER_URL = os.getenv("EMBEDDING_SERVER_URL")
+EMBEDDING_SERVER_TIMEOUT = 300 # Seconds; a large slab can take a while on CPU
+
+class OnnxSentenceEncoder:
+    """
+    ONNX Runtime version of all-MiniLM-L6-v2 for CPU-only hosts.
+    encode() mirrors the subset of SentenceTransformer.encode used in this module:
+    mean pooling over the attention mask followed by L2 normalisation.
+    """
+    def __init__(self, model_path: str):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        # Let ONNX Runtime apply all graph fusions and use every core for each forward pass
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+        ort_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+
+        if os.path.isdir(model_path):
+            self.ort_model = ORTModelForFeatureExtraction.from_pretrained(model_path, **ort_kwargs)
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        else:
+            # Export once and keep the ONNX graph on disk so later starts skip the export
+            hub_name = f"sentence-transformers/{EMBEDDING_MODEL_NAME}"
+            self.ort_model = ORTModelForFeatureExtraction.from_pretrained(hub_name, export=True, **ort_kwargs)
+            self.tokenizer = AutoTokenizer.from_pretrained(hub_name)
+            self.ort_model.save_pretrained(model_path)
+            self.tokenizer.save_pretrained(model_path)
+
+    def _encode_batch(self, texts):
+        inputs = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=EMBEDDING_MAX_SEQ_LENGTH, return_tensors="np")
+        hidden = np.asarray(self.ort_model(**inputs).last_hidden_state, dtype=np.float32)
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, show_progress_bar: bool = False,
+               normalize_embeddings: bool = True):
+        # Output is always L2-normalised, like the SentenceTransformer pipeline for this model
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.ort_model.config.hidden_size), dtype=np.float32)
+        # Encode in length order, as SentenceTransformer does, to keep padding per batch small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            embeddings[positions] = self._encode_batch([texts[i] for i in positions])
+        return embeddings[0] if single else embeddings
+
+class RemoteSentenceEncoder:
+    """
+    Client for the shared embedding server. encode() mirrors the subset of
+    SentenceTransformer.encode used in this module; the server always L2-normalises.
+    """
+    def __init__(self, server_url: str):
+        import httpx
+        self.encode_url = server_url.rstrip("/") + "/encode"
+        # One pooled client, so every call reuses an open connection to the server
+        self.http = httpx.Client(timeout=EMBEDDING_SERVER_TIMEOUT)
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, show_progress_bar: bool = False,
+               normalize_embeddings: bool = True):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        response = self.http.post(self.encode_url, json={"sentences": texts})
+        response.raise_for_status()
+        dim = int(response.headers["X-Embedding-Dim"])
+        embeddings = np.frombuffer(response.content, dtype=np.float32).reshape(len(texts), dim)
+        return embeddings[0] if single else embeddings
+
+def load_embedding_model():
+    """
+    Loads the embedding model: SentenceTransformer in FP16 on CUDA when available, otherwise the
+    ONNX Runtime export (USE_ONNX=1, the default) with SentenceTransformer on CPU as the fallback.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu" and os.getenv("USE_ONNX", "1") == "1":
+        try:
+            onnx_model = OnnxSentenceEncoder(ONNX_MODEL_PATH)
+            print("Embedding model loaded with ONNX Runtime on cpu.")
+            return onnx_model
+        except Exception as e:
+            print(f"ONNX Runtime embedding model unavailable ({e}), falling back to SentenceTransformer.")
+
+    st_model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+    if device == "cuda":
+        st_model.half()
+    else:
+        torch.set_num_threads(os.cpu_count() or 1)
+        # encode runs one forward pass at a time, so all threads go to intra-op parallelism
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            # Only allowed before torch has started any inter-op work in this process
+            print(f"Could not set torch inter-op threads: {e}")
+    print(f"Embedding model loaded on {device}.")
+    return st_model
+
+# Load model for embeddings, or connect to the shared embedding server
+if EMBEDDING_SERVER_URL:
+    model = RemoteSentenceEncoder(EMBEDDING_SERVER_URL)
+    print(f"Using embedding server at {EMBEDDING_SERVER_URL}.")
+else:
+    model = load_embedding_model()
 
 DEFAULT_TOP_K = 5
 DEFAULT_SIMILARITY_THRESHOLD = 1.3
 
 COLLECTION_NAME = "code_chunks"
 
+# Chunks and embeddings of already processed files, keyed by the SHA-256 of the file content.
+# Bump CHUNK_CACHE_VERSION whenever chunk extraction or the embedding model changes.
+CHUNK_CACHE_PATH = "data/chunk_cache.sqlite"
+CHUNK_CACHE_VERSION = "v3"
+FILE_HASH_READ_SIZE = 1024 * 1024
+CHUNK_CACHE_EMBEDDING_DTYPE = np.float16
+
 client = None
 collection = None
-
-# --- Tree-sitter Language and Parser Setup ---
-C_LANGUAGE = None
-CPP_LANGUAGE = None
-C_PARSER = None
-CPP_PARSER = None
-
-try:
-    C_LANGUAGE = get_language('c')
-    C_PARSER = tree_sitter.Parser()
-    C_PARSER.set_language(C_LANGUAGE)
-
-    CPP_LANGUAGE = get_language('cpp')
-    CPP_PARSER = tree_sitter.Parser()
-    CPP_PARSER.set_language(CPP_LANGUAGE)
-
-except Exception as e:
-    print(f"Error loading tree-sitter C/C++ parsers: {e}")
-    print("Please ensure 'tree_sitter_languages' can find and load the 'c' and 'cpp' grammars.")
-    print("You might need to install 'tree_sitter' and 'tree_sitter_languages' using pip.")
-    exit("Cannot proceed without tree-sitter parsers.")
-
-
-# --- Tree-sitter Query Patterns for C++ ---
-CPP_FUNCTION_QUERY_PATTERN = r"""
-    (function_definition
-        declarator: (function_declarator) @function.declarator_node
-        body: (compound_statement) @function.body
-    ) @function.definition
-"""
-
-CPP_CLASS_QUERY_PATTERN = r"""
-    (class_specifier
-        name: (type_identifier) @class.name
-        body: (field_declaration_list) @class.body
-    ) @class.definition
-"""
-
-CPP_STRUCT_QUERY_PATTERN = r"""
-    (struct_specifier
-        name: (type_identifier) @struct.name
-        body: (field_declaration_list) @struct.body
-    ) @struct.definition
-"""
-
-CPP_GLOBAL_ARRAY_INIT_QUERY_PATTERN = r"""
-    (init_declarator
-        declarator: (array_declarator
-            (identifier) @array.name
-            "[" "]"
-        )
-        value: (initializer_list) @array.body
-    ) @array.definition
-    (declaration
-        (array_declarator
-            (identifier) @array.name
-            "[" "]"
-        )
-        (initializer_list) @array.body
-    ) @array.definition
-"""
-
-# --- Tree-sitter Query Patterns for C (ADJUSTED for 'Invalid node type type_declarator') ---
-C_FUNCTION_QUERY_PATTERN = r"""
-    (function_definition
-        declarator: (function_declarator) @function.declarator_node
-        body: (compound_statement) @function.body
-    ) @function.definition
-"""
-
-C_CLASS_QUERY_PATTERN = r""
-
-# REVISED C_STRUCT_QUERY_PATTERN to avoid 'type_declarator' in query
-# Instead, capture the 'type_identifier' directly as the alias.
-C_STRUCT_QUERY_PATTERN = r"""
-    (struct_specifier
-        name: (type_identifier) @struct.name
-        body: (field_declaration_list) @struct.body
-    ) @struct.definition
-
-    (type_definition ; for typedef struct { ... } alias; in C
-        type: (struct_specifier
-            name: (type_identifier) @typedef_struct_name ; for optional explicit struct name
-            body: (field_declaration_list) @typedef_struct_body
-        )
-        ; Capture the type_identifier directly at the end of typedef_definition
-        (type_identifier) @typedef_alias_name ; Capture the alias name directly
-    ) @typedef_struct.definition
-"""
-
-C_GLOBAL_ARRAY_INIT_QUERY_PATTERN = r"""
-    (declaration
-        declarator: (init_declarator
-            declarator: (pointer_declarator
-                (array_declarator
-                    declarator: (identifier) @array.name
-                )
-            )
-            value: (initializer_list)
-        )
-    ) @array.definition
-    (declaration
-        declarator: (init_declarator
-            declarator: (array_declarator
-                declarator: (identifier) @array.name
-                size: (number_literal)
-            )
-            value: (initializer_list)
-        )
-    ) @array.definition
-"""
-
-
-# Universal Comment Query
-COMMENT_QUERY_PATTERN = r"""
-    (comment) @comment.block
-"""
-
-TEST_FUNCTION_NAME_PATTERN = re.compile(
-    r'(?:^|_)test_[\w\d_]*$|'
-    r'^[A-Z_]+_TEST_[\w\d_]*$|'
-    r'^[A-Z_]+_CASE_[\w\d_]*$|'
-    r'Test[A-Z][\w\d_]*$'
-, re.IGNORECASE)
-
-
-# === Code Chunk Extraction (using Tree-sitter) ===
-def extract_code_chunks(file_path: str) -> List[Dict[str, Any]]:
-    chunks = []
-    
-    file_extension = os.path.splitext(file_path)[1].lower()
-
-    current_parser = None
-    current_language = None
-    
-    if file_extension in ['.cpp', '.hpp', '.cxx']:
-        current_parser = CPP_PARSER
-        current_language = CPP_LANGUAGE
-        func_pattern_str = CPP_FUNCTION_QUERY_PATTERN
-        class_pattern_str = CPP_CLASS_QUERY_PATTERN
-        struct_pattern_str = CPP_STRUCT_QUERY_PATTERN
-        array_pattern_str = CPP_GLOBAL_ARRAY_INIT_QUERY_PATTERN
-    elif file_extension in ['.c', '.h']:
-        current_parser = C_PARSER
-        current_language = C_LANGUAGE
-        func_pattern_str = C_FUNCTION_QUERY_PATTERN
-        class_pattern_str = C_CLASS_QUERY_PATTERN
-        struct_pattern_str = C_STRUCT_QUERY_PATTERN
-        array_pattern_str = C_GLOBAL_ARRAY_INIT_QUERY_PATTERN
-        
-        if C_PARSER is None:
-             print(f"Warning: C parser not loaded, falling back to C++ parser for {file_path}")
-             current_parser = CPP_PARSER
-             current_language = CPP_LANGUAGE
-             func_pattern_str = CPP_FUNCTION_QUERY_PATTERN
-             class_pattern_str = CPP_CLASS_QUERY_PATTERN
-             struct_pattern_str = CPP_STRUCT_QUERY_PATTERN
-             array_pattern_str = CPP_GLOBAL_ARRAY_INIT_QUERY_PATTERN
-    else:
-        print(f"Warning: Unsupported file extension '{file_extension}'. Skipping {file_path}")
-        return []
-
-    if current_parser is None or current_language is None:
-        print(f"Error: No suitable parser found for file {file_path}")
-        return []
-
-    try:
-        function_query = current_language.query(func_pattern_str)
-        class_query = current_language.query(class_pattern_str) if class_pattern_str else None
-        struct_query = current_language.query(struct_pattern_str)
-        global_array_init_query = current_language.query(array_pattern_str)
-        comment_query = current_language.query(COMMENT_QUERY_PATTERN)
-    except Exception as e:
-        print(f"Error compiling tree-sitter queries for {file_extension} files: {e}")
-        print("--- Failed Query Patterns Debug ---")
-        print(f"Function Query:\n{func_pattern_str}")
-        if class_pattern_str: print(f"Class Query:\n{class_pattern_str}")
-        print(f"Struct Query:\n{struct_pattern_str}")
-        print(f"Array Query:\n{array_pattern_str}")
-        print(f"Error details: {e}")
-        print("This often means the query syntax does not match the specific grammar version or language.")
-        return []
-
-    try:
-        with open(file_path, 'rb') as f:
-            code_bytes = f.read()
-    except Exception as e:
-        print(f"Error reading file {file_path}: {e}")
-        return []
-
-    tree = current_parser.parse(code_bytes)
-    root_node = tree.root_node
-
-    # --- Helper Functions (defined within extract_code_chunks scope) ---
-    def get_node_content(node):
-        return code_bytes[node.start_byte:node.end_byte].decode('utf-8', errors='ignore')
-
-    def get_name_from_capture(captures, name_suffix):
-        for node, name in captures:
-            if name.endswith(name_suffix):
-                return node.text.decode('utf-8', errors='ignore')
-        return ""
-
-    def get_function_name_and_scope(func_declarator_node):
-        func_name = ""
-        scope_name = ""
-
-        name_node = None
-        for child in func_declarator_node.children:
-            if child.type == 'qualified_identifier':
-                name_node = child
-                break
-            elif child.type == 'identifier' or child.type == 'field_identifier':
-                name_node = child
-                
-        if name_node:
-            func_name_raw = name_node.text.decode('utf-8', errors='ignore')
-            
-            if name_node.type == 'qualified_identifier':
-                parts = func_name_raw.split('::')
-                if len(parts) > 1:
-                    scope_name = "::".join(parts[:-1])
-                    func_name = parts[-1]
-                else:
-                    func_name = func_name_raw
-            else:
-                func_name = func_name_raw
-
-        func_name = func_name.split('(')[0].strip()
-
-        final_func_name = func_name
-        if scope_name and func_name and not func_name.startswith(f"{scope_name}::"):
-            final_func_name = f"{scope_name}::{func_name}"
-            
-        return final_func_name, scope_name
-
-
-    processed_nodes = set()
-    scope_stack = []
-    cursor = root_node.walk()
-
-    def add_chunk(node, chunk_type, func_name="", class_name="", struct_name="", array_name="", test_case_function_name=""):
-        node_id = (node.start_byte, node.end_byte, node.type)
-
-        for existing_node_id in processed_nodes:
-            existing_start, existing_end, _ = existing_node_id
-            if (existing_start <= node.start_byte and existing_end >= node.end_byte) or \
-               (node.start_byte <= existing_start and node.end_byte >= existing_end):
-                return
-
-        content = get_node_content(node)
-        
-        current_class_name_in_scope = ""
-        current_struct_name_in_scope = ""
-        for scope_type, scope_name, scope_end_byte in reversed(scope_stack):
-            if node.start_byte < scope_end_byte:
-                if scope_type == "class":
-                    current_class_name_in_scope = scope_name
-                    break
-                elif scope_type == "struct":
-                    current_struct_name_in_scope = scope_name
-                    break
-        
-        final_class_name = class_name if class_name else current_class_name_in_scope
-        final_struct_name = struct_name if struct_name else current_struct_name_in_scope
-
-        chunks.append({
-            "content": content,
-            "source": os.path.basename(file_path),
-            "start_line": node.start_point[0] + 1,
-            "type": chunk_type,
-            "function_name": func_name,
-            "class_name": final_class_name,
-            "struct_name": final_struct_name,
-            "array_name": array_name,
-            "test_case_function_name": test_case_function_name
-        })
-        processed_nodes.add(node_id)
-
-
-    # --- AST Traversal Logic ---
-    if not cursor.goto_first_child():
-        for capture_node, capture_name in comment_query.captures(root_node):
-            if capture_name == "comment.block":
-                add_chunk(capture_node, "comment")
-        return chunks
-
-    while True:
-        node = cursor.node
-
-        while scope_stack and node.start_byte >= scope_stack[-1][2]:
-            scope_stack.pop()
-
-        # 1. Class Definitions (Only for C++ files)
-        if node.type == 'class_specifier' and class_query:
-            captures = class_query.captures(node)
-            class_name = get_name_from_capture(captures, "class.name")
-            if class_name:
-                add_chunk(node, "class", class_name=class_name)
-                scope_stack.append(("class", class_name, node.end_byte))
-        
-        # 2. Struct Definitions (C and C++)
-        elif node.type == 'struct_specifier' and struct_query:
-            captures = struct_query.captures(node)
-            struct_name = get_name_from_capture(captures, "struct.name")
-            if struct_name:
-                add_chunk(node, "struct", struct_name=struct_name)
-                scope_stack.append(("struct", struct_name, node.end_byte))
-
-        elif node.type == 'type_definition' and struct_query:
-            captures = struct_query.captures(node)
-            typedef_struct_name = get_name_from_capture(captures, "typedef_struct_name")
-            typedef_alias_name = get_name_from_capture(captures, "typedef_alias_name")
-
-            if typedef_alias_name:
-                add_chunk(node, "struct", struct_name=typedef_alias_name)
-                scope_stack.append(("struct", typedef_alias_name, node.end_byte))
-            elif typedef_struct_name:
-                add_chunk(node, "struct", struct_name=typedef_struct_name)
-                scope_stack.append(("struct", typedef_struct_name, node.end_byte))
-
-
-        # 3. Function Definitions (global and member)
-        elif node.type == 'function_definition' and function_query:
-            func_definition_captures = function_query.captures(node)
-            
-            func_declarator_node = None
-            for n, name in func_definition_captures:
-                if name == "function.declarator_node":
-                    func_declarator_node = n
-                    break
-
-            if func_declarator_node:
-                func_name, scope_name_from_func = get_function_name_and_scope(func_declarator_node)
-                
-                chunk_type = "function"
-                test_case_function_name = ""
-                if TEST_FUNCTION_NAME_PATTERN.search(func_name):
-                    chunk_type = "test_case_function"
-                    test_case_function_name = func_name
-                
-                add_chunk(node, chunk_type, func_name=func_name, test_case_function_name=test_case_function_name,
-                          class_name=scope_name_from_func if scope_name_from_func and current_language == CPP_LANGUAGE else "",
-                          struct_name=scope_name_from_func if scope_name_from_func and current_language == C_LANGUAGE else ""
-                          )
-
-        # 4. Global Array Initializations
-        elif node.type == 'declaration' and global_array_init_query:
-            captures = global_array_init_query.captures(node)
-            array_name = get_name_from_capture(captures, "array.name")
-            if array_name and any(n for n,n_name in captures if n_name.endswith("array.definition")):
-                add_chunk(node, "array_init", array_name=array_name)
-
-        # 5. Comments
-        elif node.type == 'comment' and comment_query:
-            add_chunk(node, "comment")
-
-
-        # --- Traversal Control ---
-        if cursor.goto_first_child():
-            continue
-        if cursor.goto_next_sibling():
-            continue
-        
-        while True:
-            if not cursor.goto_parent():
-                return chunks
-            if cursor.goto_next_sibling():
-                break
-    
-    chunks.sort(key=lambda x: x['start_line'])
-    return chunks
-
+# Set when ChromaDB runs as a server (CHROMA_HOST); queries then go through its async HTTP client
+async_collection = None
+# Semantic answer cache (AnswerCache), opened next to the code chunk collection
+answer_cache = None
 
 # === File Processing ===
+def upload_suffix(original_filename: str) -> str:
+    """
+    Returns the file extension to parse an upload with (for its temp copy), so the right parser is picked.
+    """
+    suffix = os.path.splitext(original_filename)[1].lower()
+    if suffix not in ['.c', '.cpp', '.h', '.hpp', '.cxx']:
+        suffix = '.cpp'
+    return suffix
+
 def process_and_store_uploaded_file(file_content_bytes: bytes, original_filename: str):
     """
     Processes a single uploaded file's content and stores its chunks in ChromaDB.
+    The content is parsed in memory, without a temporary file.
+    """
+    if collection is None:
+        print("Error: ChromaDB collection not initialized. Cannot process uploaded file.")
+        raise RuntimeError("ChromaDB collection not initialized.")
+
+    print(f"Processing uploaded file: {original_filename} (in memory, {len(file_content_bytes)} bytes)...")
+    file_hash = hashlib.sha256(file_content_bytes).hexdigest()
+    cached = load_cached_chunks(file_hash)
+    if cached is not None:
+        print(f"Chunk cache hit for {original_filename}, skipping parsing and embedding.")
+        chunks, embeddings = cached
+    else:
+        chunks = _extract_upload(file_content_bytes, original_filename)
+        embeddings = None
+    index_code_chunks(chunks, embeddings, original_filename, file_hash)
+
+def process_and_store_uploaded_path(file_path: str, original_filename: str):
+    """
+    Processes an uploaded file already written to disk and stores its chunks in ChromaDB.
+    The caller owns file_path and is responsible for removing it.
     """
     global collection
     if collection is None:
         print("Error: ChromaDB collection not initialized. Cannot process uploaded file.")
         raise RuntimeError("ChromaDB collection not initialized.")
 
-    suffix = os.path.splitext(original_filename)[1].lower()
-    if suffix not in ['.c', '.cpp', '.h', '.hpp', '.cxx']:
-        suffix = '.cpp'
+    print(f"Processing uploaded file: {original_filename} (path: {file_path})...")
+    file_hash = file_sha256(file_path)
+    cached = load_cached_chunks(file_hash)
+    if cached is not None:
+        print(f"Chunk cache hit for {original_filename}, skipping parsing and embedding.")
+        chunks, embeddings = cached
+    else:
+        chunks = extract_code_chunks(file_path, cache_key=original_filename)
+        embeddings = None
+    index_code_chunks(chunks, embeddings, original_filename, file_hash)
+
+# === Chunk Cache ===
+def file_sha256(file_path: str) -> str:
+    """
+    Returns the hex SHA-256 of a file's content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(FILE_HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _connect_chunk_cache():
+    # A short-lived connection per call keeps this safe to use from the upload worker threads
+    os.makedirs(os.path.dirname(CHUNK_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(CHUNK_CACHE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunk_cache ("
+        "hash TEXT PRIMARY KEY, chunks_json BLOB, embeddings_npy BLOB)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS embedding_cache (hash BLOB PRIMARY KEY, vec BLOB)")
+    return conn
+
+def _chunk_cache_key(file_hash: str) -> str:
+    return f"{CHUNK_CACHE_VERSION}:{file_hash}"
+
+def load_cached_chunks(file_hash: str):
+    """
+    Returns (chunks, embeddings) previously stored for this file hash, or None.
+    Cache errors are reported and treated as a miss.
+    """
+    try:
+        conn = _connect_chunk_cache()
+        try:
+            row = conn.execute(
+                "SELECT chunks_json, embeddings_npy FROM chunk_cache WHERE hash = ?",
+                (_chunk_cache_key(file_hash),)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error reading chunk cache: {e}")
+        return None
+    if row is None:
+        return None
+    chunks = json.loads(row[0])
+    embeddings = np.load(io.BytesIO(row[1]), allow_pickle=False)
+    return chunks, embeddings
+
+def save_cached_chunks(file_hash: str, chunks: List[Dict[str, Any]], embeddings):
+    """
+    Stores a file's chunks and their embeddings under its content hash.
+    """
+    buffer = io.BytesIO()
+    # float16 halves the cache size; the unit-length vectors lose nothing that affects ranking
+    np.save(buffer, np.asarray(embeddings, dtype=CHUNK_CACHE_EMBEDDING_DTYPE), allow_pickle=False)
+    try:
+        conn = _connect_chunk_cache()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chunk_cache (hash, chunks_json, embeddings_npy) VALUES (?, ?, ?)",
+                    (_chunk_cache_key(file_hash), json.dumps(chunks), buffer.getvalue())
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error writing chunk cache: {e}")
+
+# --- Per-text embedding cache ---
+# Complements the per-file cache above: chunks shared between files, or left unchanged when a
+# file is edited, keep their embedding. Keyed by a hash of the model name and the exact text.
+EMBEDDING_CACHE_LOOKUP_SIZE = 500 # Keys per SELECT, below SQLite's bound-parameter limit
 
-    with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix=suffix) as temp_f:
-        temp_f.write(file_content_bytes)
-        temp_file_path = temp_f.name
+def _embedding_cache_key(text: str) -> bytes:
+    return hashlib.blake2b(f"{EMBEDDING_MODEL_NAME}\0{text}".encode("utf-8"), digest_size=16).digest()
 
+def load_cached_embeddings(keys: List[bytes]) -> Dict[bytes, Any]:
+    """
+    Returns {key: embedding} for the keys found in the embedding cache.
+    Cache errors are reported and treated as misses.
+    """
+    found = {}
+    try:
+        conn = _connect_chunk_cache()
+        try:
+            for start in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_SIZE):
+                key_slice = keys[start:start + EMBEDDING_CACHE_LOOKUP_SIZE]
+                placeholders = ",".join("?" * len(key_slice))
+                for key, vec in conn.execute(f"SELECT hash, vec FROM embedding_cache WHERE hash IN ({placeholders})", key_slice):
+                    found[key] = np.frombuffer(vec, dtype=np.float32)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error reading embedding cache: {e}")
+    return found
+
+def save_cached_embeddings(keys: List[bytes], embeddings):
+    """
+    Stores one float32 embedding per key in the embedding cache.
+    """
+    rows = [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in zip(keys, embeddings)]
     try:
-        print(f"Processing uploaded file: {original_filename} (temp path: {temp_file_path})...")
-        chunks = extract_code_chunks(temp_file_path)
-
-        ids_batch = []
-        embeddings_batch = []
-        documents_batch = []
-        metadatas_batch = []
-        batch_size = 100
-
-        for chunk in chunks:
-            chunk_unique_id_str = f"{original_filename}-{chunk['start_line']}-{hash(chunk['content'])}"
-            chunk_id = str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_unique_id_str))
-            
-            embedding = model.encode(chunk["content"]).tolist()
-
-            metadata = {
-                "source": original_filename,
-                "start_line": int(chunk["start_line"]),
-                "type": str(chunk.get("type", "code")),
-                "function_name": str(chunk.get("function_name", "")),
-                "class_name": str(chunk.get("class_name", "")),
-                "struct_name": str(chunk.get("struct_name", "")),
-                "array_name": str(chunk.get("array_name", "")),
-                "test_case_function_name": str(chunk.get("test_case_function_name", ""))
-            }
-            
-            ids_batch.append(chunk_id)
-            embeddings_batch.append(embedding)
-            documents_batch.append(chunk["content"])
-            metadatas_batch.append(metadata)
-
-            if len(ids_batch) >= batch_size:
+        conn = _connect_chunk_cache()
+        try:
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO embedding_cache (hash, vec) VALUES (?, ?)", rows)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error writing embedding cache: {e}")
+
+def encode_chunks(chunks: List[Dict[str, Any]]):
+    """
+    Embeds the content of every chunk, returning a numpy array with one row per chunk.
+    Texts already in the embedding cache are not run through the model again.
+    """
+    texts = [chunk["content"] for chunk in chunks]
+    keys = [_embedding_cache_key(text) for text in texts]
+    cached = load_cached_embeddings(keys)
+    miss_positions = [i for i, key in enumerate(keys) if key not in cached]
+    # Identical texts (repeated license headers, "// TODO" comments, ...) are encoded once;
+    # every occurrence keeps its own chunk id and reuses that embedding
+    first_miss = {}
+    for i in miss_positions:
+        first_miss.setdefault(keys[i], i)
+    unique_misses = list(first_miss.values())
+    if len(unique_misses) < len(miss_positions):
+        print(f"Embedding {len(unique_misses)} unique texts for {len(miss_positions)} uncached chunks.")
+
+    encoded = None
+    if unique_misses:
+        # Encode many chunks in one batched call instead of one forward pass per chunk.
+        # SentenceTransformer.encode sorts its input by length before batching and restores the
+        # original order afterwards, so short comments and long functions are not padded together.
+        # Always pass large slabs here rather than encoding chunk by chunk, or that sorting is lost.
+        encoded = model.encode(
+            [texts[i] for i in unique_misses],
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True, # Unit vectors: ChromaDB's squared L2 distance is then 2 - 2 * cosine
+            show_progress_bar=False
+        )
+        save_cached_embeddings([keys[i] for i in unique_misses], encoded)
+        if len(unique_misses) < len(miss_positions):
+            row_of = {keys[i]: row for row, i in enumerate(unique_misses)}
+            encoded = encoded[[row_of[keys[i]] for i in miss_positions]]
+    if not cached:
+        return encoded if encoded is not None else np.zeros((0, 0), dtype=np.float32)
+
+    print(f"Embedding cache: {len(texts) - len(miss_positions)} of {len(texts)} chunks already embedded.")
+    embeddings = np.empty((len(texts), len(next(iter(cached.values())))), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in cached:
+            embeddings[i] = cached[key]
+    if miss_positions:
+        embeddings[miss_positions] = encoded
+    return embeddings
+
+def make_chunk_id(chunk: Dict[str, Any], original_filename: str) -> str:
+    """
+    Returns a chunk id that is stable across runs for the same file name, line and content.
+    """
+    # Python's hash() of a str is salted per process, so it cannot be used here
+    content_hash = hashlib.blake2b(chunk["content"].encode("utf-8"), digest_size=16).hexdigest()
+    chunk_unique_id_str = f"{original_filename}-{chunk['start_line']}-{content_hash}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_unique_id_str))
+
+class ChromaBatchWriter:
+    """
+    Adds batches to the ChromaDB collection from a background thread, so the caller can encode
+    the next slab of chunks while the previous one is inserted. Small batches, e.g. from many
+    small files, are coalesced until CHROMA_ADD_BATCH_SIZE chunks are pending. Use as a context
+    manager; leaving it flushes the rest, waits until every batch has been added and re-raises
+    the first insertion error.
+    """
+    def __init__(self, maxsize: int = 2):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.pending = ([], [], [], [])
+        self.pending_files = []
+        self.error = None
+        self.stored_any = False
+        # Chunk cache entries to write once every batch is known to be stored
+        self.cache_entries = []
+        self.thread = threading.Thread(target=self._run, name="chroma-writer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            ids_batch, embeddings_batch, documents_batch, metadatas_batch, original_filename = item
+            if self.error is not None:
+                # An earlier batch failed; drain the queue so the producer is not blocked
+                continue
+            try:
+                # upsert rather than add: ids are content-addressed, so a chunk that another
+                # upload indexed since the existence check is simply overwritten with itself
                 try:
-                    collection.add(
+                    collection.upsert(
                         ids=ids_batch,
                         embeddings=embeddings_batch,
                         documents=documents_batch,
                         metadatas=metadatas_batch
                     )
-                    print(f"Added batch of {len(ids_batch)} chunks for {original_filename}.")
-                except Exception as e:
-                    print(f"Error adding batch to ChromaDB for {original_filename}: {e}")
-                
-                ids_batch = []
-                embeddings_batch = []
-                documents_batch = []
-                metadatas_batch = []
-        
-        if ids_batch:
-            try:
-                collection.add(
-                    ids=ids_batch,
-                    embeddings=embeddings_batch,
-                    documents=documents_batch,
-                    metadatas=metadatas_batch
-                )
-                print(f"Added final batch of {len(ids_batch)} chunks for {original_filename}.")
+                except MemoryError:
+                    # Pathologically large chunks: retry the batch in smaller pieces
+                    step = CHROMA_ADD_FALLBACK_BATCH_SIZE
+                    for start in range(0, len(ids_batch), step):
+                        collection.upsert(
+                            ids=ids_batch[start:start + step],
+                            embeddings=embeddings_batch[start:start + step],
+                            documents=documents_batch[start:start + step],
+                            metadatas=metadatas_batch[start:start + step]
+                        )
+                print(f"Added batch of {len(ids_batch)} chunks for {original_filename}.")
+                self.stored_any = True
+                # Only this process's in-memory cache here; the shared answer cache is moved to a
+                # new generation once, on close, rather than with a ChromaDB write per batch
+                _clear_semantic_cache()
             except Exception as e:
-                print(f"Error adding final batch to ChromaDB for {original_filename}: {e}")
-
-        print(f"Finished processing {original_filename}. Total chunks added: {collection.count()}")
+                print(f"Error adding batch to ChromaDB for {original_filename}: {e}")
+                self.error = e
+
+    def add(self, ids_batch, embeddings_batch, documents_batch, metadatas_batch, original_filename: str):
+        for pending_column, column in zip(self.pending, (ids_batch, embeddings_batch, documents_batch, metadatas_batch)):
+            pending_column.extend(column)
+        if original_filename not in self.pending_files:
+            self.pending_files.append(original_filename)
+        while len(self.pending[0]) >= CHROMA_ADD_BATCH_SIZE:
+            self._flush(CHROMA_ADD_BATCH_SIZE)
+
+    def _flush(self, count: int):
+        batch = [column[:count] for column in self.pending]
+        for column in self.pending:
+            del column[:count]
+        label = ", ".join(self.pending_files)
+        # Files with chunks still pending stay in the label of the next batch
+        self.pending_files = self.pending_files[-1:] if self.pending[0] else []
+        # Blocks while the queue is full, which bounds how far encoding can run ahead
+        self.queue.put((*batch, label))
+
+    def cache_on_success(self, file_hash: str, chunks: List[Dict[str, Any]], embeddings):
+        """
+        Saves the file's chunks and embeddings to the chunk cache on close, unless an insert failed.
+        """
+        self.cache_entries.append((file_hash, chunks, embeddings))
+
+    def close(self):
+        if self.pending[0]:
+            self._flush(len(self.pending[0]))
+        self.queue.put(None)
+        self.thread.join()
+        if self.stored_any:
+            # Batches stored before a failure changed the collection too
+            invalidate_retrieval_cache()
+        if self.error is not None:
+            raise self.error
+        for file_hash, chunks, embeddings in self.cache_entries:
+            save_cached_chunks(file_hash, chunks, embeddings)
+        self.cache_entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def index_code_chunks(chunks: List[Dict[str, Any]], embeddings, original_filename: str, file_hash: str,
+                      writer: Optional[ChromaBatchWriter] = None):
+    """
+    Adds the chunks of one file that are not yet in ChromaDB, embedding only those.
+    embeddings is None when the chunks were freshly extracted rather than read from the chunk cache.
+    Batches go to writer when given (so several files can share one), otherwise to a writer
+    owned by this call.
+    """
+    if collection is None:
+        raise RuntimeError("ChromaDB collection not initialized.")
 
+    chunk_ids = [make_chunk_id(chunk, original_filename) for chunk in chunks]
+    existing_ids = set(collection.get(ids=chunk_ids, include=[])["ids"]) if chunk_ids else set()
+    new_positions = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in existing_ids]
+    if not new_positions:
+        print(f"All {len(chunks)} chunks of {original_filename} are already indexed, skipping.")
+        return
+    if existing_ids:
+        print(f"Skipping {len(existing_ids)} chunks of {original_filename} that are already indexed.")
+
+    new_chunks = [chunks[i] for i in new_positions]
+    new_ids = [chunk_ids[i] for i in new_positions]
+
+    own_writer = writer is None
+    if own_writer:
+        writer = ChromaBatchWriter()
+    try:
+        if embeddings is None:
+            # Encode in slabs and hand each one to the writer right away, so ChromaDB inserts
+            # the previous slab while the model works on the next
+            slabs = []
+            for start in range(0, len(new_chunks), ENCODE_SLAB_SIZE):
+                slab_chunks = new_chunks[start:start + ENCODE_SLAB_SIZE]
+                slab_embeddings = encode_chunks(slab_chunks)
+                store_code_chunks(slab_chunks, new_ids[start:start + ENCODE_SLAB_SIZE], slab_embeddings, original_filename, writer)
+                slabs.append(slab_embeddings)
+            # Only a complete set of embeddings can be cached for the file, and only once stored
+            if len(new_chunks) == len(chunks):
+                writer.cache_on_success(file_hash, chunks, np.concatenate(slabs))
+        else:
+            store_code_chunks(new_chunks, new_ids, embeddings[new_positions], original_filename, writer)
     finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            print(f"Cleaned up temporary file: {temp_file_path}")
+        if own_writer:
+            writer.close()
+            print(f"Finished processing {original_filename}. Total chunks in collection: {collection.count()}")
 
-# === Chunk Retriever ===
-def retrieve_relevant_chunks(query: str, top_k: int = DEFAULT_TOP_K, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, filter_type: Optional[str] = None) -> list[dict]:
+def store_code_chunks(chunks: List[Dict[str, Any]], chunk_ids: List[str], embeddings, original_filename: str,
+                      writer: ChromaBatchWriter):
     """
-    Retrieves relevant code chunks from ChromaDB based on a query, with optional filtering by chunk type.
+    Queues already extracted and embedded chunks of one file for insertion into ChromaDB.
+    """
+    # Build every column in one pass each, then hand out slices, rather than appending per chunk
+    source_basename = os.path.basename(original_filename)
+    embeddings_all = np.asarray(embeddings).tolist()
+    documents_all = [chunk["content"] for chunk in chunks]
+    metadatas_all = [
+        {
+            "source": original_filename,
+            "source_basename": source_basename,
+            "start_line": int(chunk["start_line"]),
+            "type": chunk.get("type") or "code",
+            "function_name": chunk.get("function_name", ""),
+            "class_name": chunk.get("class_name", ""),
+            "struct_name": chunk.get("struct_name", ""),
+            "array_name": chunk.get("array_name", ""),
+            "test_case_function_name": chunk.get("test_case_function_name", "")
+        }
+        for chunk in chunks
+    ]
+
+    for start in range(0, len(chunk_ids), CHROMA_ADD_BATCH_SIZE):
+        end = start + CHROMA_ADD_BATCH_SIZE
+        writer.add(chunk_ids[start:end], embeddings_all[start:end], documents_all[start:end],
+                   metadatas_all[start:end], original_filename)
+
+def _upload_sha256(source) -> str:
+    return hashlib.sha256(source).hexdigest() if isinstance(source, bytes) else file_sha256(source)
+
+def _extract_upload(source, original_filename: str) -> List[Dict[str, Any]]:
+    # In this process the parse tree cache survives between uploads, so re-uploads parse incrementally
+    if isinstance(source, bytes):
+        # The extension picks the parser, so unknown ones get the same .cpp default as on disk
+        source_name = os.path.splitext(original_filename)[0] + upload_suffix(original_filename)
+        return extract_code_chunks_from_source(source, source_name, cache_key=original_filename)
+    return extract_code_chunks(source, cache_key=original_filename)
+
+def process_many_files(files: List[tuple]):
+    """
+    Processes several uploaded files, given as (source, original_filename) pairs where source is
+    either the file's content as bytes (small uploads, parsed in memory) or the path of a copy on
+    disk. When there is enough source on disk to pay for it, those files are extracted in a pool
+    of worker processes, one file per task; embedding and ChromaDB insertion stay in this process,
+    so only one model instance is ever loaded. The caller owns the file paths and is responsible
+    for removing them.
     """
-    global collection
     if collection is None:
-        print("Error: ChromaDB collection not initialized. Cannot retrieve chunks.")
-        return []
+        print("Error: ChromaDB collection not initialized. Cannot process uploaded files.")
+        raise RuntimeError("ChromaDB collection not initialized.")
+    if not files:
+        return
+
+    file_hashes = [_upload_sha256(source) for source, _ in files]
+    cached = [load_cached_chunks(file_hash) for file_hash in file_hashes]
+    # Only files missing from the chunk cache need parsing
+    misses = [i for i, hit in enumerate(cached) if hit is None]
+    pool_misses = [i for i in misses if not isinstance(files[i][0], bytes)]
+    max_workers = min(len(pool_misses), os.cpu_count() or 1)
+    if max_workers <= 1 or sum(os.path.getsize(files[i][0]) for i in pool_misses) < PARALLEL_EXTRACT_MIN_BYTES:
+        pool_misses = []
+
+    extracted = {}
+    if pool_misses:
+        print(f"Extracting chunks from {len(pool_misses)} files with {max_workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_parsers) as ex:
+            extracted.update(zip(pool_misses, ex.map(extract_code_chunks, [files[i][0] for i in pool_misses])))
+    for i in misses:
+        if i not in extracted:
+            extracted[i] = _extract_upload(*files[i])
+
+    # One writer for all files, so inserting one file overlaps with encoding the next
+    with ChromaBatchWriter() as writer:
+        for i, ((_, original_filename), file_hash, hit) in enumerate(zip(files, file_hashes, cached)):
+            if hit is not None:
+                print(f"Chunk cache hit for {original_filename}, skipping parsing and embedding.")
+                chunks, embeddings = hit
+            else:
+                chunks = extracted[i]
+                embeddings = None
+            index_code_chunks(chunks, embeddings, original_filename, file_hash, writer)
+    print(f"Finished processing {len(files)} files. Total chunks in collection: {collection.count()}")
 
-    print(f"DEBUG: retrieve_relevant_chunks received query='{query}' with top_k={top_k}, similarity_threshold={similarity_threshold}, filter_type={filter_type}")
+# === Chunk Retriever ===
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Semantic retrieval cache: results of recent queries, reused for a new query whose embedding is
+# nearly identical (cosine similarity above the threshold) and that asks with the same parameters.
+# Embeddings are L2-normalised, so the dot product is the cosine similarity.
+SEMANTIC_CACHE_SIZE = 256
+SEMANTIC_CACHE_MIN_SIMILARITY = 0.95
+# Invalidation only reaches this process, so entries also expire: uploads handled by another
+# worker (or another backend sharing a ChromaDB server) show up after at most this long
+SEMANTIC_CACHE_TTL_SECONDS = 300
+_semantic_cache_lock = threading.Lock()
+_semantic_cache_embeddings = None # (N, dim) array, one row per entry
+_semantic_cache_entries = [] # (params, results, stored_at), aligned with the rows above
+# Bumped on every invalidation; results computed under an older generation are not stored
+_semantic_cache_generation = 0
+
+def _clear_semantic_cache():
+    global _semantic_cache_embeddings, _semantic_cache_generation
+    with _semantic_cache_lock:
+        _semantic_cache_embeddings = None
+        _semantic_cache_entries.clear()
+        _semantic_cache_generation += 1
+
+def invalidate_retrieval_cache():
+    """
+    Drops all cached retrieval results and moves the answer cache to a new generation.
+    Called whenever the collection's contents change; blocks on a ChromaDB write.
+    """
+    _clear_semantic_cache()
+    if answer_cache is not None:
+        answer_cache.invalidate()
 
-    query_embedding = model.encode(query).tolist()
+def retrieval_cache_generation() -> int:
+    """
+    Changes whenever the collection's contents change, so results fetched under another value are stale.
+    """
+    return _semantic_cache_generation
 
-    where_clause = {}
+def _semantic_cache_lookup(query_embedding, params):
+    """
+    Returns (cached results or None, current generation). Pass the generation to
+    _semantic_cache_store so a result computed across an invalidation is dropped.
+    """
+    with _semantic_cache_lock:
+        generation = _semantic_cache_generation
+        if _semantic_cache_embeddings is None:
+            return None, generation
+        oldest_fresh = time.monotonic() - SEMANTIC_CACHE_TTL_SECONDS
+        similarities = _semantic_cache_embeddings @ query_embedding
+        # Best match first among unexpired entries asked with the same top_k, threshold and filter
+        for i in np.argsort(similarities)[::-1]:
+            if similarities[i] < SEMANTIC_CACHE_MIN_SIMILARITY:
+                return None, generation
+            entry_params, results, stored_at = _semantic_cache_entries[i]
+            if entry_params == params and stored_at >= oldest_fresh:
+                return [dict(item) for item in results], generation
+    return None, generation
+
+def _semantic_cache_store(query_embedding, params, results, generation: int):
+    global _semantic_cache_embeddings
+    with _semantic_cache_lock:
+        if generation != _semantic_cache_generation:
+            # The collection changed while this retrieval ran
+            return
+        row = query_embedding[None, :]
+        if _semantic_cache_embeddings is None:
+            _semantic_cache_embeddings = row
+        else:
+            _semantic_cache_embeddings = np.vstack([_semantic_cache_embeddings, row])[-SEMANTIC_CACHE_SIZE:]
+        _semantic_cache_entries.append((params, [dict(item) for item in results], time.monotonic()))
+        del _semantic_cache_entries[:-SEMANTIC_CACHE_SIZE]
+
+@lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def _encode_query(query: str) -> tuple:
+    # Retried and repeated questions skip the model; a tuple because cached values must not be mutated
+    return tuple(model.encode(query, convert_to_numpy=True, normalize_embeddings=True).tolist())
+
+def _query_kwargs(query_embedding: list, top_k: int, filter_type: Optional[str]) -> dict:
+    kwargs = {
+        "query_embeddings": [query_embedding],
+        "n_results": top_k,
+        "include": ['documents', 'metadatas', 'distances'],
+    }
     if filter_type:
-        where_clause["type"] = {"$eq": filter_type}
-
-    if where_clause:
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=['documents', 'metadatas', 'distances'],
-            where=where_clause
-        )
-    else:
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=['documents', 'metadatas', 'distances']
-        )
+        kwargs["where"] = {"type": {"$eq": filter_type}}
+    return kwargs
 
-    retrieved_info = []
-    if results and results['documents'] and results['distances'] and results['metadatas']:
-        for i in range(len(results['documents'][0])):
-            doc_content = results['documents'][0][i]
-            metadata = results['metadatas'][0][i]
-            distance = results['distances'][0][i]
-
-            if distance < similarity_threshold:
-                retrieved_info.append({
-                    "content": doc_content,
-                    "source": metadata.get("source", "N/A"),
-                    "start_line": metadata.get("start_line", -1),
-                    "type": metadata.get("type", "code"),
-                    "function_name": metadata.get("function_name", ""),
-                    "class_name": metadata.get("class_name", ""),
-                    "struct_name": metadata.get("struct_name", ""),
-                    "array_name": metadata.get("array_name", ""),
-                    "test_case_function_name": metadata.get("test_case_function_name", ""),
-                    "distance": distance
-                })
-            else:
-                print(f"Skipping chunk due to low similarity (distance {distance:.4f} >= threshold {similarity_threshold:.4f}): {doc_content[:50]}...")
-
-    retrieved_info.sort(key=lambda x: x['distance'])
-
-    unique_retrieved_info = []
-    seen_unique_keys = set()
-    for item in retrieved_info:
-        unique_key = (item['content'], item['source'], item['start_line'], item['type'],
-                      item['function_name'], item['class_name'], item['struct_name'],
-                      item['array_name'], item['test_case_function_name'])
-        if unique_key not in seen_unique_keys:
-            unique_retrieved_info.append(item)
-            seen_unique_keys.add(unique_key)
-            
-    print(f"Retrieved {len(unique_retrieved_info)} unique chunks for query: '{query}'")
+def _collect_results(results, similarity_threshold: float) -> list[dict]:
+    if not (results and results['ids'] and results['ids'][0]):
+        return []
+    # Zip the parallel result columns once and filter in a single comprehension. ChromaDB already
+    # returns results ordered by distance, so no sort is needed, and chunk ids are derived from
+    # file, line and content, so dict.fromkeys-style dedup on the id keeps the closest copy.
+    rows = [
+        (chunk_id, doc_content, metadata, distance)
+        for chunk_id, doc_content, metadata, distance in zip(
+            results['ids'][0], results['documents'][0], results['metadatas'][0], results['distances'][0])
+        if distance < similarity_threshold
+    ]
+    if log.isEnabledFor(logging.DEBUG) and len(rows) < len(results['ids'][0]):
+        log.debug("Skipped %d chunks with distance >= threshold %.4f",
+                  len(results['ids'][0]) - len(rows), similarity_threshold)
+
+    seen = {}
+    for chunk_id, doc_content, metadata, distance in rows:
+        if chunk_id in seen:
+            continue
+        get = metadata.get
+        seen[chunk_id] = {
+            "id": chunk_id,
+            "content": doc_content,
+            "source": get("source", "N/A"),
+            "source_basename": get("source_basename", ""),
+            "start_line": get("start_line", -1),
+            "type": get("type", "code"),
+            "function_name": get("function_name", ""),
+            "class_name": get("class_name", ""),
+            "struct_name": get("struct_name", ""),
+            "array_name": get("array_name", ""),
+            "test_case_function_name": get("test_case_function_name", ""),
+            "distance": distance
+        }
+    return list(seen.values())
+
+def _log_retrieved_chunks(query: str, unique_retrieved_info: list[dict]):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+
+    log.debug("Retrieved %d unique chunks for query: %r", len(unique_retrieved_info), query)
     for i, chunk in enumerate(unique_retrieved_info):
         name_parts = []
         if chunk.get('function_name'): name_parts.append(f"Func={chunk['function_name']}")
@@ -564,12 +759,166 @@ def retrieve_relevant_chunks(query: str, top_k: int = DEFAULT_TOP_K, similarity_
         
         name_info = ", ".join(name_parts) if name_parts else 'N/A'
 
-        print(f"  Chunk {i+1}: Source={chunk['source']}, Line={chunk['start_line']}, Type={chunk['type']}, {name_info}, Distance={chunk['distance']:.4f}")
-        print(f"  --- Content Start ---\n{chunk['content']}\n  --- Content End ---")
+        log.debug("  Chunk %d: Source=%s, Line=%s, Type=%s, %s, Distance=%.4f",
+                  i + 1, chunk['source'], chunk['start_line'], chunk['type'], name_info, chunk['distance'])
+        log.debug("  --- Content Start ---\n%s\n  --- Content End ---", chunk['content'])
+
+def retrieve_relevant_chunks(query: str, top_k: int = DEFAULT_TOP_K, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, filter_type: Optional[str] = None) -> list[dict]:
+    """
+    Retrieves relevant code chunks from ChromaDB based on a query, with optional filtering by chunk type.
+    """
+    global collection
+    if collection is None:
+        print("Error: ChromaDB collection not initialized. Cannot retrieve chunks.")
+        return []
+
+    log.debug("retrieve_relevant_chunks received query=%r with top_k=%s, similarity_threshold=%s, filter_type=%s",
+              query, top_k, similarity_threshold, filter_type)
+
+    query_embedding = list(_encode_query(query))
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    cache_params = (top_k, similarity_threshold, filter_type)
+    cached_results, cache_generation = _semantic_cache_lookup(query_vector, cache_params)
+    if cached_results is not None:
+        log.debug("Semantic cache hit for query=%r", query)
+        return cached_results
 
+    results = collection.query(**_query_kwargs(query_embedding, top_k, filter_type))
+
+    unique_retrieved_info = _collect_results(results, similarity_threshold)
+    _semantic_cache_store(query_vector, cache_params, unique_retrieved_info, cache_generation)
+    _log_retrieved_chunks(query, unique_retrieved_info)
+    return unique_retrieved_info
+
+async def retrieve_relevant_chunks_async(query: str, top_k: int = DEFAULT_TOP_K, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, filter_type: Optional[str] = None) -> list[dict]:
+    """
+    Async variant of retrieve_relevant_chunks. With a ChromaDB server (async_collection set) the
+    query is awaited on its HTTP client, so concurrent requests share one connection pool instead
+    of each holding a worker thread. Otherwise the sync version runs in a worker thread.
+    """
+    if async_collection is None:
+        return await asyncio.to_thread(retrieve_relevant_chunks, query, top_k, similarity_threshold, filter_type)
+
+    log.debug("retrieve_relevant_chunks_async received query=%r with top_k=%s, similarity_threshold=%s, filter_type=%s",
+              query, top_k, similarity_threshold, filter_type)
+
+    # Encoding is CPU-bound, so it still runs off the event loop
+    query_embedding = list(await asyncio.to_thread(_encode_query, query))
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    cache_params = (top_k, similarity_threshold, filter_type)
+    cached_results, cache_generation = _semantic_cache_lookup(query_vector, cache_params)
+    if cached_results is not None:
+        log.debug("Semantic cache hit for query=%r", query)
+        return cached_results
+
+    results = await async_collection.query(**_query_kwargs(query_embedding, top_k, filter_type))
+
+    unique_retrieved_info = _collect_results(results, similarity_threshold)
+    _semantic_cache_store(query_vector, cache_params, unique_retrieved_info, cache_generation)
+    _log_retrieved_chunks(query, unique_retrieved_info)
     return unique_retrieved_info
 
+# === Answer Cache ===
+ANSWER_CACHE_COLLECTION_NAME = "qa_cache"
+# Squared L2 distance between unit query embeddings (2 - 2 * cosine), so 0.05 means cosine
+# similarity above 0.975: stricter than retrieval, since the whole answer is reused
+ANSWER_CACHE_MAX_DISTANCE = 0.05
+ANSWER_CACHE_GENERATION_KEY = "generation"
+
+class AnswerCache:
+    """
+    Persistent semantic cache of whole answers in a second ChromaDB collection. Each entry holds
+    the query embedding, the answer and the retrieved chunks it was based on. A new question whose
+    embedding is within ANSWER_CACHE_MAX_DISTANCE of a cached one, asked with the same parameters,
+    gets that answer back without retrieval or an LLM call. Cache errors are reported and treated
+    as misses, so a broken cache never fails a request.
+
+    Entries are tagged with the generation stored in the collection's metadata. invalidate() writes
+    a new generation as soon as the code collection has changed, and every worker sharing the
+    collection reads it before each lookup, so older entries stop matching everywhere at once.
+    """
+    def __init__(self, chroma_client):
+        self.client = chroma_client
+        self.lock = threading.Lock()
+        self.collection = self.client.get_or_create_collection(
+            name=ANSWER_CACHE_COLLECTION_NAME,
+            embedding_function=None
+        )
+
+    def invalidate(self):
+        """
+        Moves the cache to a new generation, so no worker returns answers from before the change.
+        """
+        # A random token rather than a counter, so two workers invalidating at once never write
+        # the same value and lose one of the invalidations
+        generation = uuid.uuid4().hex
+        try:
+            with self.lock:
+                self.collection.modify(metadata={ANSWER_CACHE_GENERATION_KEY: generation})
+                # Entries of older generations can no longer match; drop them to keep the index small
+                self.collection.delete(where={ANSWER_CACHE_GENERATION_KEY: {"$ne": generation}})
+        except Exception as e:
+            print(f"Error invalidating answer cache: {e}")
+            return
+        print("Answer cache invalidated after the codebase changed.")
+
+    def _current_generation(self) -> str:
+        # Re-read the collection, since another worker may have moved it to a new generation
+        self.collection = self.client.get_collection(name=ANSWER_CACHE_COLLECTION_NAME, embedding_function=None)
+        return (self.collection.metadata or {}).get(ANSWER_CACHE_GENERATION_KEY, "")
+
+    @staticmethod
+    def _where(params: dict, generation: str) -> dict:
+        conditions = [{key: {"$eq": value}} for key, value in params.items()]
+        conditions.append({ANSWER_CACHE_GENERATION_KEY: {"$eq": generation}})
+        return {"$and": conditions}
+
+    def lookup(self, query: str, params: dict):
+        """
+        Returns (cached (answer, context) or None, generation) for a near-identical query asked
+        with the same params. Pass the generation to store, so an answer computed while the
+        codebase changed is not cached under the new generation.
+        """
+        try:
+            query_embedding = list(_encode_query(query))
+            with self.lock:
+                generation = self._current_generation()
+                results = self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=1,
+                    where=self._where(params, generation),
+                    include=['documents', 'metadatas', 'distances']
+                )
+        except Exception as e:
+            print(f"Error reading answer cache: {e}")
+            return None, None
+        if not results['ids'][0] or results['distances'][0][0] >= ANSWER_CACHE_MAX_DISTANCE:
+            return None, generation
+        return (results['documents'][0][0], json.loads(results['metadatas'][0][0]['context'])), generation
+
+    def store(self, query: str, params: dict, answer: str, context: dict, generation: Optional[str]):
+        """
+        Caches answer for query under params, unless the cache moved past generation (the value
+        lookup returned) in the meantime. context must be JSON-serialisable.
+        """
+        if generation is None:
+            return
+        entry_id = hashlib.blake2b(json.dumps([query, params], sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+        try:
+            query_embedding = list(_encode_query(query))
+            with self.lock:
+                if self._current_generation() != generation:
+                    return
+                self.collection.upsert(
+                    ids=[entry_id],
+                    embeddings=[query_embedding],
+                    documents=[answer],
+                    metadatas=[{**params, ANSWER_CACHE_GENERATION_KEY: generation, "context": json.dumps(context)}]
+                )
+        except Exception as e:
+            print(f"Error writing answer cache: {e}")
+
 # Example of how you would initialize client and collection in your main application:
 # from chromadb.config import Settings
 # client = chromadb.PersistentClient(path="./chroma_db") # or chromadb.Client() for in-memory
-# collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=EMBEDDING_FUNCTION_CHROMA)
\ No newline at end of file
+# collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=None)
\ No newline at end of file
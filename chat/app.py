@@ -32,26 +32,24 @@ if uploaded_file and not st.session_state.uploaded_files_processed:
     if st.sidebar.button("Process Uploaded Files"):
         st.sidebar.info("Processing files... This may take a moment.")
         
-        backend_upload_url = "http://localhost:8000/upload_code_file"
+        backend_upload_url = "http://localhost:8000/upload_code_files"
         all_uploads_successful = True
         
-        for file in uploaded_file:
-            files_to_send = {'file': (file.name, file.getvalue(), file.type)}
-            try:
-                upload_response = requests.post(backend_upload_url, files=files_to_send)
-                if upload_response.status_code == 200:
-                    st.sidebar.success(f"Successfully processed: {file.name}")
-                else:
-                    st.sidebar.error(f"Failed to process {file.name}: {upload_response.text}")
-                    all_uploads_successful = False
-            except requests.exceptions.ConnectionError:
-                st.sidebar.error("⚠️ Could not connect to the backend API. Please ensure it's running at `http://localhost:8000`.")
-                all_uploads_successful = False
-                break
-            except Exception as e:
-                st.sidebar.error(f"⚠️ An unexpected error occurred during upload for {file.name}: {e}")
+        # All files go in one multipart request, so the backend can parse them in parallel
+        files_to_send = [('files', (file.name, file.getvalue(), file.type)) for file in uploaded_file]
+        try:
+            upload_response = requests.post(backend_upload_url, files=files_to_send)
+            if upload_response.status_code == 200:
+                st.sidebar.success(f"Successfully processed: {', '.join(file.name for file in uploaded_file)}")
+            else:
+                st.sidebar.error(f"Failed to process files: {upload_response.text}")
                 all_uploads_successful = False
-                break
+        except requests.exceptions.ConnectionError:
+            st.sidebar.error("⚠️ Could not connect to the backend API. Please ensure it's running at `http://localhost:8000`.")
+            all_uploads_successful = False
+        except Exception as e:
+            st.sidebar.error(f"⚠️ An unexpected error occurred during upload: {e}")
+            all_uploads_successful = False
         
         if all_uploads_successful:
             st.session_state.uploaded_files_processed = True
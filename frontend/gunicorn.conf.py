@@ -0,0 +1,17 @@
+# Gunicorn settings for server.py: gunicorn -c gunicorn.conf.py server:app
+# Threaded workers rather than gevent: bcrypt and SQLite calls run in C and release the GIL, so
+# real threads overlap them, while under gevent they would block every greenlet of the worker.
+# FLASK_SECRET_KEY is required so all workers share sessions; BCRYPT_COST optionally fixes the hash cost.
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = 8 # One per pooled SQLite connection (DB_POOL_SIZE)
+timeout = 60
+
+def on_starting(server):
+    # Fail in the master rather than boot workers that would each pick their own random key
+    if not os.getenv("FLASK_SECRET_KEY"):
+        raise RuntimeError("FLASK_SECRET_KEY must be set when serving with gunicorn.")
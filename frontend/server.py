@@ -1,32 +1,157 @@
 from flask import Flask, render_template, request, jsonify, session
 from flask_cors import CORS
+from flask_compress import Compress
 import os
+import queue
 import sqlite3
 import bcrypt
-from flask_session import Session
 import json
+import orjson
+import atexit
+import hashlib
+import time
+import threading
+from cachetools import TTLCache
 from datetime import datetime
+from contextlib import contextmanager
+from functools import wraps
 
 app = Flask(__name__)
 
 # Enable CORS for React frontend
 CORS(app, supports_credentials=True)
 
-# Session config
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "your-secret-key-change-in-production")
-app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_PERMANENT"] = False
-Session(app)
+# Compress JSON responses such as /api/files (whole source files) and /api/chat; source code
+# compresses several times over. Bodies under COMPRESS_MIN_SIZE are not worth the CPU.
+app.config["COMPRESS_MIMETYPES"] = ['application/json', 'text/html']
+app.config["COMPRESS_ALGORITHM"] = ['br', 'gzip']
+app.config["COMPRESS_LEVEL"] = 6
+app.config["COMPRESS_MIN_SIZE"] = 1024
+Compress(app)
+
+# Session config: Flask's signed-cookie sessions. The session only holds the user's id, name and
+# email, so it travels in the cookie and no request reads or writes session files on disk.
+# The secret key now guards every session, so never fall back to a fixed, published value.
+app.secret_key = os.getenv("FLASK_SECRET_KEY")
+if not app.secret_key:
+    # A random key is only acceptable for the single-process dev server
+    if "gunicorn" in os.environ.get("SERVER_SOFTWARE", ""):
+        raise RuntimeError("FLASK_SECRET_KEY must be set when serving with gunicorn.")
+    print("Warning: FLASK_SECRET_KEY is not set; using a random key, so sessions end on restart "
+          "and are not shared between worker processes.")
+    app.secret_key = os.urandom(32)
+app.config["SESSION_COOKIE_HTTPONLY"] = True
+
+# Larger request bodies are rejected with 413 before they are read
+app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024
+
+DATABASE_PATH = "database.db"
+# Uploaded file contents live here as uploads/<user_id>/<sha256>.txt; SQLite only keeps the path
+UPLOADS_DIR = "uploads"
+# Connections are opened once and shared between requests instead of one connect/close per request
+DB_POOL_SIZE = 8
+db_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+# Writes that still hit "database is locked" (e.g. a read transaction upgrading to a write) are retried
+DB_LOCKED_RETRIES = 5
+DB_LOCKED_BACKOFF_SECONDS = 0.05
 
 # Initialize DB
-def get_db_connection():
-    conn = sqlite3.connect("database.db", check_same_thread=False)
+def create_db_connection():
+    # Pooled connections live for the whole process, so their prepared-statement caches stay warm.
+    # Every query here is a constant SQL string (values are bound), so each text is prepared once
+    # per connection; 256 leaves plenty of room for all of them.
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # Wait for a concurrent writer instead of failing with "database is locked"
+    conn.execute("PRAGMA busy_timeout=30000")
+    # WAL only needs fsync at checkpoints with synchronous=NORMAL and stays consistent on a crash
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16384") # 16 MB page cache per pooled connection
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
+def retry_on_locked(f):
+    """Retries a database write with exponential backoff while SQLite reports the database as locked."""
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        for attempt in range(DB_LOCKED_RETRIES):
+            try:
+                return f(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if "database is locked" not in str(e) or attempt == DB_LOCKED_RETRIES - 1:
+                    raise
+                time.sleep(DB_LOCKED_BACKOFF_SECONDS * 2 ** attempt)
+    return wrap
+
+@contextmanager
+def borrow_db():
+    """Borrows a pooled connection for the duration of a with block."""
+    db = db_pool.get()
+    try:
+        yield db
+    finally:
+        # Never hand the next request a connection with an open transaction
+        if db.in_transaction:
+            db.rollback()
+        db_pool.put(db)
+
+def write_user_file(user_id, content):
+    """Writes content to disk, named by its hash, and returns (path, size in bytes)."""
+    data = content.encode('utf-8')
+    user_dir = os.path.join(UPLOADS_DIR, str(user_id))
+    path = os.path.join(user_dir, hashlib.sha256(data).hexdigest() + ".txt")
+    if not os.path.exists(path):
+        os.makedirs(user_dir, exist_ok=True)
+        # Write to a temporary name and rename, so readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return path, len(data)
+
+def read_user_file(path, max_chars=-1):
+    # newline='' returns the content exactly as uploaded, without translating \r\n
+    with open(path, encoding='utf-8', newline='') as f:
+        return f.read(max_chars)
+
+def remove_user_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def migrate_file_contents_to_disk(db):
+    """
+    One-time migration for databases created before contents moved to disk: writes every stored
+    content to UPLOADS_DIR, records its path and size, then drops the content column.
+    """
+    # Every gunicorn worker runs init_db as it boots. Take the write lock before looking at the
+    # schema, so only the first worker migrates and the others wait, then find nothing to do.
+    db.execute("BEGIN IMMEDIATE")
+    columns = {row['name'] for row in db.execute("PRAGMA table_info(user_files)")}
+    if 'content' not in columns:
+        return
+    print("Moving user_files contents from the database to disk...")
+    if 'content_path' not in columns:
+        db.execute("ALTER TABLE user_files ADD COLUMN content_path TEXT")
+        db.execute("ALTER TABLE user_files ADD COLUMN size_bytes INTEGER")
+    rows = db.execute("SELECT id, user_id, content FROM user_files WHERE content_path IS NULL").fetchall()
+    for row in rows:
+        path, size_bytes = write_user_file(row['user_id'], row['content'])
+        db.execute("UPDATE user_files SET content_path = ?, size_bytes = ? WHERE id = ?", (path, size_bytes, row['id']))
+    db.execute("ALTER TABLE user_files DROP COLUMN content")
+    print(f"Moved {len(rows)} files to {UPLOADS_DIR}/.")
+
 def init_db():
-    db = get_db_connection()
-    with db:
+    for _ in range(DB_POOL_SIZE):
+        db_pool.put(create_db_connection())
+    with borrow_db() as db:
+        # Readers no longer block on a writer (or the other way round). The journal mode is
+        # stored in the database file, so setting it once covers every connection.
+        db.execute("PRAGMA journal_mode=WAL")
+    with borrow_db() as db, db:
         db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,17 +176,245 @@ def init_db():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 filename TEXT NOT NULL,
-                content TEXT NOT NULL,
+                content_path TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
                 file_type TEXT NOT NULL,
                 uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             );
         """)
-    db.close()
+        # SQLite does not index foreign keys; every per-user query filters on user_id and orders
+        # by time, so both columns go into the index. users.email is already indexed by UNIQUE.
+        db.execute("CREATE INDEX IF NOT EXISTS idx_user_files_user_id ON user_files (user_id, uploaded_at DESC)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_user_ts ON query_logs (user_id, timestamp DESC)")
+    with borrow_db() as db, db:
+        migrate_file_contents_to_disk(db)
 
 # Initialize database on startup
 init_db()
 
+# bcrypt is deliberately slow. The C implementation releases the GIL, and allowing only as many
+# hashes at once as there are cores keeps a burst of logins from oversubscribing the CPU while
+# other requests are served.
+bcrypt_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# The work factor is calibrated on the first hash so it takes about BCRYPT_TARGET_SECONDS on this
+# host, never dropping below BCRYPT_MIN_COST. BCRYPT_COST in the environment skips calibration
+# but is held to the same floor.
+BCRYPT_TARGET_SECONDS = 0.25
+BCRYPT_MIN_COST = 12
+BCRYPT_MAX_COST = 16
+
+def calibrate_bcrypt_cost():
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=BCRYPT_MIN_COST))
+    elapsed = time.perf_counter() - start
+    # Each extra round doubles the work, so one measurement is enough to extrapolate
+    cost = BCRYPT_MIN_COST
+    while cost < BCRYPT_MAX_COST and elapsed * 2 <= BCRYPT_TARGET_SECONDS:
+        elapsed *= 2
+        cost += 1
+    print(f"bcrypt cost {cost} (~{elapsed * 1000:.0f} ms per hash)")
+    return cost
+
+bcrypt_cost_lock = threading.Lock()
+
+def get_bcrypt_cost():
+    # Calibrating at import would cost every worker a slow hash at boot; the lock makes
+    # concurrent first logins calibrate only once
+    with bcrypt_cost_lock:
+        if "BCRYPT_COST" not in app.config:
+            app.config["BCRYPT_COST"] = max(BCRYPT_MIN_COST, int(os.getenv("BCRYPT_COST") or calibrate_bcrypt_cost()))
+        return app.config["BCRYPT_COST"]
+
+def hash_password(password):
+    salt = bcrypt.gensalt(rounds=get_bcrypt_cost())
+    with bcrypt_slots:
+        return bcrypt.hashpw(password.encode('utf-8'), salt)
+
+def check_password(password, hashed_pw):
+    with bcrypt_slots:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_pw)
+
+# /api/chat only shows this much of the user's code
+CHAT_CONTEXT_PREVIEW_CHARS = 500
+
+# Finished context preview of each user's files for /api/chat; it does not depend on the question,
+# so repeated questions skip the SELECT and the file reads. Dropped on upload; the TTL bounds how
+# long another worker's stale copy can live.
+USER_FILES_CACHE_SIZE = 1024
+USER_FILES_CACHE_TTL_SECONDS = 60
+user_files_cache = TTLCache(maxsize=USER_FILES_CACHE_SIZE, ttl=USER_FILES_CACHE_TTL_SECONDS)
+user_files_cache_lock = threading.Lock() # TTLCache is not thread-safe
+
+def get_context_preview(user_id):
+    with user_files_cache_lock:
+        preview = user_files_cache.get(user_id)
+    if preview is None:
+        with borrow_db() as db:
+            # Rows are consumed lazily, so SQLite stops stepping (and no further file is opened)
+            # as soon as the preview is full, however many files the user has
+            rows = db.execute("SELECT filename, content_path FROM user_files WHERE user_id = ?", (user_id,))
+            preview = build_context_preview((row['filename'], row['content_path']) for row in rows)
+        with user_files_cache_lock:
+            user_files_cache[user_id] = preview
+    return preview
+
+def build_context_preview(files, limit=CHAT_CONTEXT_PREVIEW_CHARS):
+    """
+    Joins "--- filename ---" headers and file contents, given as (filename, content_path) pairs,
+    up to limit characters. Each file is read only as far as the remaining budget reaches.
+    """
+    parts = []
+    total = 0
+    for filename, content_path in files:
+        if total >= limit:
+            break
+        header = f"\n--- {filename} ---\n"
+        remaining = limit - total - len(header)
+        try:
+            content = read_user_file(content_path, remaining) if remaining > 0 else ""
+        except FileNotFoundError:
+            # Replaced by a concurrent upload after the rows were read
+            continue
+        part = f"{header}{content}\n"
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)[:limit]
+
+@retry_on_locked
+def create_user(name, email, hashed_pw):
+    """Inserts a user and returns its id, or None when the email is already registered."""
+    # No existence check first: the UNIQUE constraint on email rejects duplicates atomically,
+    # including two signups with the same email racing each other
+    try:
+        with borrow_db() as db, db:
+            cursor = db.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?)", 
+                                (name, email, hashed_pw))
+            return cursor.lastrowid
+    except sqlite3.IntegrityError:
+        return None
+
+def replace_user_files(user_id, files):
+    # Contents go to disk first, outside the write lock; the database rows only point at them
+    stored = [(file_data, *write_user_file(user_id, file_data['content'])) for file_data in files]
+    replaced_paths = insert_user_file_rows(user_id, stored)
+    # Only once the new rows are committed: a rolled back upload keeps its old rows, and their files
+    remove_unreferenced_user_files(user_id, replaced_paths)
+
+@retry_on_locked
+def insert_user_file_rows(user_id, stored):
+    """Replaces the user's rows with the stored files and returns the paths no longer listed."""
+    # One transaction (and one commit) for the whole upload: "with db" commits on success
+    # and rolls back on error, so a failed upload leaves the previous files in place
+    with borrow_db() as db, db:
+        # Take the write lock up front, so concurrent uploads by the same user replace rows one
+        # at a time
+        db.execute("BEGIN IMMEDIATE")
+        old_paths = {row['content_path'] for row in db.execute(
+            "SELECT content_path FROM user_files WHERE user_id = ?", (user_id,))}
+
+        # Clear existing files for this user
+        db.execute("DELETE FROM user_files WHERE user_id = ?", (user_id,))
+
+        # Insert new files. A generator, so the rows are not copied into another list;
+        # executemany consumes it one row at a time.
+        db.executemany("""
+            INSERT INTO user_files (user_id, filename, content_path, size_bytes, file_type) 
+            VALUES (?, ?, ?, ?, ?)
+        """, ((user_id, file_data['name'], path, size_bytes, file_data['type']) for file_data, path, size_bytes in stored))
+
+        # Another upload's cleanup may have removed one of our files before we took the lock
+        for file_data, path, _ in stored:
+            if not os.path.exists(path):
+                write_user_file(user_id, file_data['content'])
+    return old_paths - {path for _, path, _ in stored}
+
+@retry_on_locked
+def remove_unreferenced_user_files(user_id, paths):
+    if not paths:
+        return
+    with borrow_db() as db:
+        # Under the write lock, so a concurrent upload of the same content checks for its file
+        # either before it is removed here (and still finds the row) or after (and rewrites it).
+        # Nothing is written; borrow_db rolls the transaction back.
+        db.execute("BEGIN IMMEDIATE")
+        # Files live under the user's own directory, so only this user's rows can reference them
+        referenced = {row['content_path'] for row in db.execute(
+            "SELECT content_path FROM user_files WHERE user_id = ?", (user_id,))}
+        remove_user_files(paths - referenced)
+
+@retry_on_locked
+def write_query_logs(entries):
+    with borrow_db() as db, db:
+        db.executemany("""
+            INSERT INTO query_logs (user_id, query, response) 
+            VALUES (?, ?, ?)
+        """, entries)
+
+# Chat exchanges are logged by a background thread, off the request path: it collects up to
+# QUERY_LOG_BATCH_SIZE entries or waits QUERY_LOG_FLUSH_SECONDS, then writes them in one
+# transaction. /api/query-logs can therefore lag a new question by up to that delay.
+QUERY_LOG_BATCH_SIZE = 100
+QUERY_LOG_FLUSH_SECONDS = 0.2
+log_queue = queue.Queue(maxsize=10000) # put() blocks when full, so a stalled writer cannot exhaust memory
+
+def query_log_writer():
+    while True:
+        entry = log_queue.get()
+        if entry is None:
+            return
+        batch = [entry]
+        stopping = False
+        deadline = time.monotonic() + QUERY_LOG_FLUSH_SECONDS
+        while len(batch) < QUERY_LOG_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = log_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is None:
+                stopping = True
+                break
+            batch.append(entry)
+        try:
+            write_query_logs(batch)
+        except Exception as e:
+            print(f"Error writing {len(batch)} query logs: {e}")
+        if stopping:
+            return
+
+query_log_thread = threading.Thread(target=query_log_writer, name="query-log-writer", daemon=True)
+query_log_thread.start()
+
+@atexit.register
+def flush_query_logs():
+    # Write whatever is still queued before the process exits
+    log_queue.put(None)
+    query_log_thread.join(timeout=5)
+
+def ojsonify(obj, status=200):
+    """jsonify() with orjson, for responses carrying file contents or many rows."""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def login_required(f):
+    """Rejects requests without a logged-in user before the route runs or parses its body."""
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        return f(*args, **kwargs)
+    return wrap
+
+@app.before_request
+def reject_oversized_request():
+    # Werkzeug only enforces MAX_CONTENT_LENGTH once the body is read, inside the routes'
+    # catch-all error handling; a declared length can be refused up front with a proper 413
+    if request.content_length is not None and request.content_length > app.config["MAX_CONTENT_LENGTH"]:
+        return jsonify({'error': 'Request too large'}), 413
+
 # API Routes
 @app.route('/api/signup', methods=['POST'])
 def signup():
@@ -75,23 +428,11 @@ def signup():
             return jsonify({'error': 'All fields are required'}), 400
 
         # Hash password
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed_pw = hash_password(password)
 
-        db = get_db_connection()
-        cursor = db.cursor()
-        
-        # Check if email exists
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        if cursor.fetchone():
-            db.close()
+        user_id = create_user(name, email, hashed_pw)
+        if user_id is None:
             return jsonify({'error': 'Email already exists'}), 400
-        
-        # Insert new user
-        cursor.execute("INSERT INTO users (name, email, password) VALUES (?, ?, ?)", 
-                       (name, email, hashed_pw))
-        db.commit()
-        user_id = cursor.lastrowid
-        db.close()
 
         # Set session
         session['user_id'] = user_id
@@ -120,13 +461,12 @@ def login():
         if not (email and password):
             return jsonify({'error': 'Email and password are required'}), 400
 
-        db = get_db_connection()
-        cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        user = cursor.fetchone()
-        db.close()
+        with borrow_db() as db:
+            cursor = db.cursor()
+            cursor.execute("SELECT id, name, email, password FROM users WHERE email = ?", (email,))
+            user = cursor.fetchone()
 
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
+        if user and check_password(password, user['password']):
             session['user_id'] = user['id']
             session['user_name'] = user['name']
             session['user_email'] = user['email']
@@ -163,10 +503,8 @@ def get_user():
     return jsonify({'user': None})
 
 @app.route('/api/upload-files', methods=['POST'])
+@login_required
 def upload_files():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-
     try:
         data = request.get_json()
         files = data.get('files', [])
@@ -175,21 +513,9 @@ def upload_files():
         if not files:
             return jsonify({'error': 'No files provided'}), 400
 
-        db = get_db_connection()
-        cursor = db.cursor()
-
-        # Clear existing files for this user
-        cursor.execute("DELETE FROM user_files WHERE user_id = ?", (user_id,))
-
-        # Insert new files
-        for file_data in files:
-            cursor.execute("""
-                INSERT INTO user_files (user_id, filename, content, file_type) 
-                VALUES (?, ?, ?, ?)
-            """, (user_id, file_data['name'], file_data['content'], file_data['type']))
-
-        db.commit()
-        db.close()
+        replace_user_files(user_id, files)
+        with user_files_cache_lock:
+            user_files_cache.pop(user_id, None)
 
         return jsonify({'success': True, 'message': f'Uploaded {len(files)} files'})
 
@@ -197,42 +523,47 @@ def upload_files():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/files', methods=['GET'])
+@login_required
 def get_files():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-
     try:
         user_id = session['user_id']
-        db = get_db_connection()
-        cursor = db.cursor()
-        
-        cursor.execute("""
-            SELECT filename, content, file_type, uploaded_at 
-            FROM user_files 
-            WHERE user_id = ? 
-            ORDER BY uploaded_at DESC
-        """, (user_id,))
+        # ?metadata_only=1 lists the files without reading their contents from disk
+        metadata_only = request.args.get('metadata_only') == '1'
+        with borrow_db() as db:
+            cursor = db.cursor()
+            
+            cursor.execute("""
+                SELECT filename, content_path, size_bytes, file_type, uploaded_at 
+                FROM user_files 
+                WHERE user_id = ? 
+                ORDER BY uploaded_at DESC
+            """, (user_id,))
+            rows = cursor.fetchall()
         
         files = []
-        for row in cursor.fetchall():
-            files.append({
+        for row in rows:
+            file_info = {
                 'name': row['filename'],
-                'content': row['content'],
                 'type': row['file_type'],
+                'size': row['size_bytes'],
                 'uploaded_at': row['uploaded_at']
-            })
+            }
+            if not metadata_only:
+                try:
+                    file_info['content'] = read_user_file(row['content_path'])
+                except FileNotFoundError:
+                    # Replaced by a concurrent upload after the rows were read
+                    continue
+            files.append(file_info)
         
-        db.close()
-        return jsonify({'files': files})
+        return ojsonify({'files': files})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/chat', methods=['POST'])
+@login_required
 def chat():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-
     try:
         data = request.get_json()
         query = data.get('query')
@@ -241,29 +572,16 @@ def chat():
         if not query:
             return jsonify({'error': 'Query is required'}), 400
 
-        # Get user's files for context
-        db = get_db_connection()
-        cursor = db.cursor()
-        cursor.execute("SELECT filename, content FROM user_files WHERE user_id = ?", (user_id,))
-        files = cursor.fetchall()
-
         # Simple response generation (replace with actual RAG implementation)
-        context = ""
-        for file in files:
-            context += f"\n--- {file['filename']} ---\n{file['content']}\n"
+        context = get_context_preview(user_id)
 
         # Placeholder response (integrate with your AI service here)
-        response = f"Based on your uploaded C/C++ files, here's information about: {query}\n\nContext from your codebase:\n{context[:500]}..."
+        response = f"Based on your uploaded C/C++ files, here's information about: {query}\n\nContext from your codebase:\n{context}..."
 
-        # Log the query
-        cursor.execute("""
-            INSERT INTO query_logs (user_id, query, response) 
-            VALUES (?, ?, ?)
-        """, (user_id, query, response))
-        db.commit()
-        db.close()
+        # Log the query in the background; the response does not wait for the write
+        log_queue.put((user_id, query, response))
 
-        return jsonify({
+        return ojsonify({
             'success': True,
             'response': response
         })
@@ -272,33 +590,31 @@ def chat():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/query-logs', methods=['GET'])
+@login_required
 def get_query_logs():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-
     try:
         user_id = session['user_id']
-        db = get_db_connection()
-        cursor = db.cursor()
-        
-        cursor.execute("""
-            SELECT query, response, timestamp 
-            FROM query_logs 
-            WHERE user_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 20
-        """, (user_id,))
+        with borrow_db() as db:
+            cursor = db.cursor()
+            
+            cursor.execute("""
+                SELECT query, response, timestamp 
+                FROM query_logs 
+                WHERE user_id = ? 
+                ORDER BY timestamp DESC 
+                LIMIT 20
+            """, (user_id,))
+            rows = cursor.fetchall()
         
         logs = []
-        for row in cursor.fetchall():
+        for row in rows:
             logs.append({
                 'query': row['query'],
                 'response': row['response'],
                 'timestamp': row['timestamp']
             })
         
-        db.close()
-        return jsonify({'logs': logs})
+        return ojsonify({'logs': logs})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -310,4 +626,8 @@ def serve_react_app(path):
     return render_template('index.html')
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # The debug server (with its interactive debugger) is for local development only
+    if os.getenv("DEV"):
+        app.run(debug=True, port=5000)
+    else:
+        print("Set DEV=1 to run the debug server; in production use: gunicorn -c gunicorn.conf.py server:app")
@@ -93,8 +93,7 @@ export const BackendFileUpload: React.FC<BackendFileUploadProps> = ({
     setSuccess('');
 
     try {
-      const uploadPromises = cppFiles.map(file => backendApi.uploadCodeFile(file));
-      await Promise.all(uploadPromises);
+      await backendApi.uploadCodeFiles(cppFiles);
       
       const fileNames = cppFiles.map(f => f.name);
       setUploadedFiles(prev => [...prev, ...fileNames]);
@@ -67,6 +67,24 @@ class BackendApiService {
     return response.json();
   }
 
+  // Sends all files in one multipart request; the backend parses them in parallel
+  async uploadCodeFiles(files: File[]): Promise<{ message: string }> {
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+
+    const response = await fetch(`${BACKEND_BASE_URL}/upload_code_files`, {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!response.ok) {
+      const errorData = await response.text();
+      throw new Error(`Upload failed: ${errorData}`);
+    }
+
+    return response.json();
+  }
+
   async clearCodebase(): Promise<{ message: string }> {
     return this.request('/clear_codebase', {
       method: 'POST',
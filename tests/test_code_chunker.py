@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from backend import code_chunker
+
+
+class TestFunctionNameTest(unittest.TestCase):
+    def test_scope_qualified_test_methods_are_tests(self):
+        for name in ["MathTest::TestAdd", "Suite::TestFoo", "UnitTest_TestFoo", "Foo::test_bar", "TestFoo", "MY_TEST_x"]:
+            self.assertTrue(code_chunker.is_test_function_name(name), name)
+
+    def test_ordinary_names_are_not_tests(self):
+        for name in ["latestValue", "LatestValue", "Testing", "runTests", "Foo::bar"]:
+            self.assertFalse(code_chunker.is_test_function_name(name), name)
+
+
+class ExtractCodeChunksTest(unittest.TestCase):
+    def test_qualified_test_method_is_a_test_case_function(self):
+        source = b"int MathTest::TestAdd() { return 1 + 1; }\nint MathTest::add(int a) { return a; }\n"
+        with tempfile.NamedTemporaryFile(suffix=".cpp", delete=False) as f:
+            f.write(source)
+        try:
+            chunks = code_chunker.extract_code_chunks(f.name)
+        finally:
+            os.unlink(f.name)
+        types = {chunk["function_name"]: chunk["type"] for chunk in chunks}
+        self.assertEqual(types["MathTest::TestAdd"], "test_case_function")
+        self.assertEqual(types["MathTest::add"], "function")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from backend import llm_module
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """
+    Stands in for the Gemini model: records every prompt and answers each "### Q<n>:" with "### A<n>:".
+    """
+    def __init__(self, fail_batched=False):
+        self.prompts = []
+        self.fail_batched = fail_batched
+
+    async def generate_content_async(self, prompt, stream=False, generation_config=None):
+        self.prompts.append(prompt)
+        await asyncio.sleep(0)
+        count = prompt.count("### Q")
+        if count and self.fail_batched:
+            raise RuntimeError("batched request failed")
+        if count:
+            return FakeResponse("\n".join(f"### A{i}:\nanswer {i}\n```mermaid\ngraph TD\n```" for i in range(1, count + 1)))
+        return FakeResponse("single answer\n```mermaid\ngraph TD\n```")
+
+
+class QueryBatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.batcher = llm_module.QueryBatcher()
+        self.batcher.start()
+
+    async def asyncTearDown(self):
+        self.batcher.stop()
+
+    async def test_concurrent_questions_share_one_request(self):
+        model = FakeModel()
+
+        async def submit_later():
+            # Arrives after the first question was taken off an otherwise empty queue
+            await asyncio.sleep(llm_module.BATCH_WAIT_MS / 4000)
+            return await self.batcher.submit("second?", ["int f() { return 1; }"])
+
+        with mock.patch.object(llm_module, "get_model", return_value=model):
+            answers = await asyncio.gather(
+                self.batcher.submit("first?", ["int f() { return 1; }"]),
+                submit_later(),
+            )
+        self.assertEqual(len(model.prompts), 1)
+        self.assertTrue(answers[0].startswith("answer 1"))
+        self.assertTrue(answers[1].startswith("answer 2"))
+
+    async def test_failed_batch_falls_back_to_single_requests(self):
+        model = FakeModel(fail_batched=True)
+        with mock.patch.object(llm_module, "get_model", return_value=model):
+            answers = await asyncio.gather(
+                self.batcher.submit("first?", ["int f() { return 1; }"]),
+                self.batcher.submit("second?", ["int f() { return 1; }"]),
+            )
+        # One failed batched request, then one request per question
+        self.assertEqual(len(model.prompts), 3)
+        self.assertEqual([answer.split("\n")[0] for answer in answers], ["single answer", "single answer"])
+
+
+if __name__ == "__main__":
+    unittest.main()